@@ -1,26 +1,87 @@
 import io
 import logging
+import mmap
+import os
 import struct
 import zlib
-from typing import Generator, Optional, Tuple
+from typing import Any, Generator, Optional, Tuple
 
-from typing_extensions import Buffer
+from typing_extensions import Buffer, Self
 
 logger = logging.getLogger(__name__)
 
 headerpattern = "<BBBBIBBHBBHH"
-headersize = struct.calcsize(headerpattern)
+# compile once, these are used for every block
+headerstruct = struct.Struct(headerpattern)
+headersize = headerstruct.size
+# every header starts with the gzip magic, deflate method, and extra field flag
+headermagic = b"\x1f\x8b\x08\x04"
 tailpattern = "<II"
-tailsize = struct.calcsize(tailpattern)
+tailstruct = struct.Struct(tailpattern)
+tailsize = tailstruct.size
+# block size is stored as a 16 bit integer minus one
+blocksizemax = 1 << 16
+# raw deflate streams, the gzip header and tail of each block are handled separately
+wbits = -15
 
 
 class BlockGZipReader:
     raw: io.IOBase
+    # created when blocks are first fetched, see get_mapped
+    mapped: Optional[mmap.mmap]
+    mappable: bool
 
     def __init__(self, raw: io.IOBase):
         assert raw.seekable()
         self.raw = raw
         assert self.check_is_block_gzip()
+        self.mapped = None
+        self.mappable = True
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        closes the memory-mapping of the file, if any
+        the underlying file is left open
+        """
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+
+    def get_mapped(self, end: int) -> Optional[mmap.mmap]:
+        """
+        memory-map real files so fetching blocks doesn't need to read them
+        other file-likes e.g. in memory or remote are read from as usual
+
+        mapped on first use, and mapped again if the file has grown and more of it is needed
+        """
+        if not self.mappable:
+            return None
+        if self.mapped is not None and len(self.mapped) >= end:
+            return self.mapped
+        try:
+            fileno = self.raw.fileno()
+        except (AttributeError, OSError):
+            # not a real file e.g. io.BytesIO
+            self.mappable = False
+            return None
+        if self.mapped is not None and os.fstat(fileno).st_size <= len(self.mapped):
+            # not grown, the end is beyond the end of the file
+            return self.mapped
+        try:
+            mapped = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # can't be mapped e.g. an empty file
+            return None
+        # views of a previous mapping may still be in use
+        # so leave it to be closed once they are gone
+        self.mapped = mapped
+        return mapped
 
     def seek(self, offset: int) -> int:
         return self.raw.seek(offset)
@@ -44,14 +105,17 @@ class BlockGZipReader:
         also checks if it has a gzip header
         will seek to start of file
         """
-        if not self.check_is_gzip():
+        # read everything needed at once rather than a read for each check
+        self.raw.seek(0)
+        bytes_data = self.raw.read(16)
+        if len(bytes_data) < 16:
+            return False
+        # gzip magic and deflate compression method
+        if bytes_data[:3] != b"\x1f\x8b\x08":
             return False
         # NOTE assumes there is only one extra header
         # not sure if this is required by block gzip spec or not
-        self.raw.seek(12)
-        bytes_data = self.raw.read(4)
-        header = struct.unpack("<ccH", bytes_data)
-        return bool(header[0] == b"B" and header[1] == b"C" and header[2] == 2)
+        return bool(bytes_data[12:16] == b"BC\x02\x00")
 
     @staticmethod
     def check_is_header(header: Tuple[int, ...]) -> bool:
@@ -82,7 +146,7 @@ class BlockGZipReader:
         bytesread = self.raw.read(headersize)
         if len(bytesread) < headersize:
             raise EOFError(f"Expected to read {headersize} read {len(bytesread)}")
-        header = struct.unpack(headerpattern, bytesread)
+        header = headerstruct.unpack(bytesread)
         assert self.check_is_header(header)
         return header
 
@@ -106,7 +170,7 @@ class BlockGZipReader:
         tailbytes = self.raw.read(tailsize)
         if len(tailbytes) != tailsize:
             raise ValueError(f"Unable to read {tailsize} bytes for tail")
-        tail_crc, tail_isize = struct.unpack(tailpattern, tailbytes)
+        tail_crc, tail_isize = tailstruct.unpack(tailbytes)
         # if we were given the decompressed data, check it matches expectation
         if decompressed:
             # check decompressed size is expected
@@ -124,16 +188,8 @@ class BlockGZipReader:
         """
         cdata = self.get_cdata(header)
         # now do the actual decompression
-        decompressor = zlib.decompressobj(
-            wbits=-15
-        )  # we've alread read the header, so ignore it
-        decompressed = decompressor.decompress(cdata)
-        assert (
-            not decompressor.unconsumed_tail
-        ), f"unconsumed tail of {len(decompressor.unconsumed_tail)}"
-        assert (
-            not decompressor.unused_data
-        ), f"unused data present of {len(decompressor.unused_data)}"
+        # the header gives the exact size so all of it is one complete stream
+        decompressed = zlib.decompress(cdata, wbits=wbits)
         return cdata, decompressed
 
     def get_block(
@@ -148,10 +204,80 @@ class BlockGZipReader:
         """
         if not header:
             header = self.get_header()
-        cdata, decompressed = self.get_cdata_decompressed(header)
-        tail = self.get_tail(decompressed)
+        cdata = self.get_cdata(header)
+        # tail has the decompressed size, so read it first and decompress in one go
+        tail = self.get_tail()
+        decompressed = self.decompress_cdata(cdata, tail)
         return header, cdata, decompressed, tail
 
+    @staticmethod
+    def decompress_cdata(cdata: Buffer, tail: Tuple[int, int]) -> bytes:
+        """
+        decompresses the compressed data of a block
+        uses the crc checksum and size in the tail of the block to validate the result
+        """
+        tail_crc, tail_isize = tail
+        # block is a single complete deflate stream without gzip header
+        # output size is known so allocate it up front rather than growing
+        decompressed = zlib.decompress(cdata, wbits=wbits, bufsize=tail_isize)
+        # check decompressed size is expected
+        assert len(decompressed) == tail_isize
+        # check crc check is expected
+        assert zlib.crc32(decompressed) == tail_crc
+        return decompressed
+
+    @classmethod
+    def generate_buffer_blocks(
+        cls, data: memoryview, last: Optional[int] = None
+    ) -> Generator[Tuple[int, bytes], None, None]:
+        """
+        generator that yields the offset and decompressed content of each complete block
+        in an in-memory buffer that starts at the beginning of a block
+
+        optionally stops after the block at the last offset, so nothing beyond is decompressed
+
+        raises EOFError if a block that is needed is cut off by the end of the buffer
+
+        slices of the buffer are decompressed directly, nothing is copied
+        """
+        offset = 0
+        while offset < len(data) and (last is None or offset <= last):
+            if offset + headersize > len(data):
+                raise EOFError(f"Block header at {offset} cut off at {len(data)}")
+            header = headerstruct.unpack_from(data, offset)
+            assert cls.check_is_header(header)
+            # total block size is stored minus one
+            blockend = offset + header[11] + 1
+            if blockend > len(data):
+                raise EOFError(
+                    f"Block at {offset} to {blockend} cut off at {len(data)}"
+                )
+            # extra fields are XLEN bytes after the fixed part of the header
+            # release the slice even on error, so the buffer can be closed
+            with data[offset + 12 + header[7] : blockend - tailsize] as cdata:
+                tail = tailstruct.unpack_from(data, blockend - tailsize)
+                decompressed = cls.decompress_cdata(cdata, tail)
+            yield offset, decompressed
+            offset = blockend
+
+    def generate_blocks(self, end: int) -> Generator[Tuple[int, bytes], None, None]:
+        """
+        starting from the current position, assuming file is currently at start of a block,
+        generator that yields the file offset and decompressed content of each block up to
+        and including the block that starts at the end point
+
+        reads the whole range from the file at once rather than block by block
+        """
+        start = self.raw.tell()
+        # the last block might be as large as a block can be
+        mapped = self.get_mapped(end + blocksizemax)
+        if mapped is not None:
+            data = memoryview(mapped)[start : end + blocksizemax]
+        else:
+            data = memoryview(self.raw.read(end - start + blocksizemax))
+        for offset, decompressed in self.generate_buffer_blocks(data, end - start):
+            yield start + offset, decompressed
+
     def get_block_lines(
         self, header: Optional[Tuple[int, ...]] = None
     ) -> Tuple[
@@ -239,6 +365,62 @@ class BlockGZipReader:
             tail,
         )
 
+    def scan_block_header(self, end: int = -1) -> Tuple[int, Tuple[int, ...]]:
+        """
+        starting from the current position, scan forward through the file for the next block start
+
+        returns where the block starts and its header, leaving the file pointing after the header
+        """
+        bufferstart = self.raw.tell()
+        if end >= 0 and bufferstart >= end:
+            # reach the end without finding a block
+            raise EOFError()
+
+        # usually already at the start of a block, so check there first
+        # without reading any further into the file
+        buffer = self.raw.read(headersize)
+        if len(buffer) == headersize:
+            header = headerstruct.unpack(buffer)
+            if self.check_is_header(header):
+                return bufferstart, header
+
+        # otherwise read ahead in large chunks and search for the fixed start of a header
+        # rather than reading and checking one byte at a time
+        # where in the buffer to search from, the start has already been checked
+        pos = min(1, len(buffer))
+        while True:
+            i = buffer.find(headermagic, pos)
+            if i < 0:
+                # keep the end, it might be the start of a header split across reads
+                i = max(len(buffer) - len(headermagic) + 1, pos)
+            elif len(buffer) - i >= headersize:
+                if end >= 0 and bufferstart + i >= end:
+                    # reach the end without finding a block
+                    raise EOFError()
+                header = headerstruct.unpack_from(buffer, i)
+                # this is a valid location for a block
+                if self.check_is_header(header):
+                    blockstart = bufferstart + i
+                    self.raw.seek(blockstart + headersize)
+                    return blockstart, header
+                # move ahead a byte
+                pos = i + 1
+                continue
+
+            # need more of the file to check from i onwards
+            if end >= 0 and bufferstart + i >= end:
+                # reach the end without finding a block
+                raise EOFError()
+            buffer = buffer[i:]
+            bufferstart += i
+            pos = 0
+            bytesread = self.raw.read(blocksizemax)
+            # check not at end
+            if not bytesread:
+                logger.warning(f"Unable to read up to {headersize}")
+                raise EOFError()
+            buffer = buffer + bytesread
+
     def scan_block_lines_offset(
         self, end: int = -1
     ) -> Tuple[
@@ -259,55 +441,32 @@ class BlockGZipReader:
 
         will read the block and leave the file pointing at the start of the next block
         """
-        buffer = b""
-        blockstart = self.raw.tell()
-
-        # as long as there is more file to read
-        while end < 0 or blockstart < end:
-            # populate buffer
-            if len(buffer) < headersize:
-                bytesread = self.raw.read(headersize - len(buffer))
-                buffer = buffer + bytesread
-            # check not at end
-            if len(buffer) < headersize:
-                logger.warning(f"Unable to read up to {headersize}")
-                raise EOFError()
-
-            header = struct.unpack(headerpattern, buffer)
-            # this is a valid location for a block
-            if not self.check_is_header(header):
-                # move ahead a byte
-                buffer = buffer[1:]
-                blockstart += 1
-            else:
-                # this is a valid location for a block
-                (
-                    header,
-                    cdata,
-                    decompressed,
-                    firstline,
-                    lines,
-                    lastline,
-                    offsetstarts,
-                    offsetends,
-                    tail,
-                ) = self.get_block_lines_offset(header)
-                blockend = self.raw.tell()
-                return (
-                    blockstart,
-                    blockend,
-                    header,
-                    cdata,
-                    decompressed,
-                    firstline,
-                    lines,
-                    lastline,
-                    offsetstarts,
-                    offsetends,
-                    tail,
-                )
-        # reach the end of the file without finding a block
-        raise EOFError()
+        blockstart, header = self.scan_block_header(end)
+        (
+            header,
+            cdata,
+            decompressed,
+            firstline,
+            lines,
+            lastline,
+            offsetstarts,
+            offsetends,
+            tail,
+        ) = self.get_block_lines_offset(header)
+        blockend = self.raw.tell()
+        return (
+            blockstart,
+            blockend,
+            header,
+            cdata,
+            decompressed,
+            firstline,
+            lines,
+            lastline,
+            offsetstarts,
+            offsetends,
+            tail,
+        )
 
     def generate_lines_offset(
         self, end: int = -1
@@ -376,8 +535,30 @@ class BlockGZipReader:
             offsetstart_previous = offsetends[-1] + 1
 
     def generate_lines(self, end: int = -1) -> Generator[bytes, None, None]:
-        for _, _, _, _, line in self.generate_lines_offset(end):
-            yield line
+        """
+        starting from the current position, scan forward through the file
+        generator that yields each line in the file, like generate_lines_offset
+        but without working out where each line is so whole blocks are split at once
+        """
+        partialline = b""
+        while True:
+            _, header = self.scan_block_header(end)
+            _, _, decompressed, _ = self.get_block(header)
+            if not decompressed:
+                # empty block is end of file
+                if partialline:
+                    yield partialline
+                return
+            # line endings can abut block ending so keep them
+            lines = decompressed.splitlines(keepends=True)
+            # append holdover partial line to initial line to make a new line
+            lines[0] = partialline + lines[0]
+            # keep the last partial line for next block
+            if lines[-1].endswith(b"\n"):
+                partialline = b""
+            else:
+                partialline = lines.pop()
+            yield from lines
 
 
 class BlockGZipWriter(io.BufferedIOBase):
@@ -387,14 +568,15 @@ class BlockGZipWriter(io.BufferedIOBase):
         self.raw = raw
         assert self.raw.writable()
         self.block_size = block_size
-        self.block_buffer = b""
+        # extended in place, so many small writes don't copy the whole buffer each time
+        self.block_buffer = bytearray()
 
     def write(self, data: Buffer) -> int:
-        self.block_buffer = self.block_buffer + data
+        self.block_buffer += data
         write_size = 0
         while len(self.block_buffer) > self.block_size:
-            content = self.block_buffer[: self.block_size]
-            self.block_buffer = self.block_buffer[len(content) :]
+            content = bytes(self.block_buffer[: self.block_size])
+            del self.block_buffer[: self.block_size]
             block = self.make_block(content)
             self.raw.write(block)
             write_size += len(block)
@@ -402,8 +584,8 @@ class BlockGZipWriter(io.BufferedIOBase):
 
     def flush(self) -> None:
         while len(self.block_buffer):
-            content = self.block_buffer[: self.block_size]
-            self.block_buffer = self.block_buffer[len(content) :]
+            content = bytes(self.block_buffer[: self.block_size])
+            del self.block_buffer[: self.block_size]
             block = self.make_block(content)
             self.raw.write(block)
         self.raw.flush()
@@ -417,7 +599,7 @@ class BlockGZipWriter(io.BufferedIOBase):
     @staticmethod
     def compress_content(content: bytes) -> bytes:
         # make a new compressor each time
-        compressor = zlib.compressobj(wbits=-15)
+        compressor = zlib.compressobj(wbits=wbits)
         compressed = compressor.compress(content)
         compressed = compressed + compressor.flush()
 
@@ -438,7 +620,7 @@ class BlockGZipWriter(io.BufferedIOBase):
         header[9] = 67
         header[10] = 2
         header[11] = len(compressed) + 6 + 19
-        headerbytes = struct.pack(headerpattern, *header)
+        headerbytes = headerstruct.pack(*header)
         return headerbytes
 
     @staticmethod
@@ -446,7 +628,7 @@ class BlockGZipWriter(io.BufferedIOBase):
         tail_crc = zlib.crc32(content)
         tail_isize = len(content)
         tail = [tail_crc, tail_isize]
-        tailbytes = struct.pack(tailpattern, *tail)
+        tailbytes = tailstruct.pack(*tail)
         return tailbytes
 
     @classmethod
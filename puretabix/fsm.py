@@ -20,6 +20,7 @@ from typing import (
     Mapping,
     Optional,
     Pattern,
+    Tuple,
     Type,
     Union,
 )
@@ -32,6 +33,10 @@ logger = logging.getLogger(__name__)
 # This might be able to be captured in newer Python versions with Protocol and/or ParamSpec
 
 
+# the destination state, callback, and run pattern for an input to a state
+Matched = Tuple[Any, Optional[Callable[..., None]], Optional[Pattern[str]]]
+
+
 class RegexTransition:
     dst: Any
     condition: Pattern[str]
@@ -72,6 +77,28 @@ class SetInTransition:
         return bool(_input in self.condition)
 
 
+class SetInRunTransition(SetInTransition):
+    """
+    As SetInTransition, but when it loops back to the same state and is the first
+    transition of that state, a whole run of inputs that match it are taken at once
+    from a string. The callback is called once with the run, rather than once per character.
+    """
+
+    run_pattern: Pattern[str]
+
+    __slots__ = ["run_pattern"]
+
+    def __init__(
+        self,
+        destination_state: Any,
+        condition: Iterable[str],
+        callback: Optional[Callable[[Any, str], None]],
+    ):
+        super().__init__(destination_state, condition, callback)
+        chars = "".join(re.escape(c) for c in self.condition if c is not None)
+        self.run_pattern = re.compile(f"[{chars}]+" if chars else "(?!)")
+
+
 class SetNotInTransition:
     dst: Any
     condition: FrozenSet[str]
@@ -93,11 +120,38 @@ class SetNotInTransition:
         return bool(_input not in self.condition)
 
 
+class SetNotInRunTransition(SetNotInTransition):
+    """
+    As SetNotInTransition, but when it loops back to the same state and is the first
+    transition of that state, a whole run of inputs that match it are taken at once
+    from a string. The callback is called once with the run, rather than once per character.
+    """
+
+    run_pattern: Pattern[str]
+
+    __slots__ = ["run_pattern"]
+
+    def __init__(
+        self,
+        destination_state: Any,
+        condition: Iterable[str],
+        callback: Optional[Callable[[Any, str], None]],
+    ):
+        super().__init__(destination_state, condition, callback)
+        # None can be in the condition for the end of input, but can't be part of a run
+        chars = "".join(re.escape(c) for c in self.condition if c is not None)
+        self.run_pattern = re.compile(f"[^{chars}]+" if chars else ".+", re.DOTALL)
+
+
 class FSMachine:
     transitions: Dict[Any, Any]
+    matched: Dict[Any, Dict[Optional[str], Matched]]
 
     def __init__(self) -> None:
         self.transitions = {}
+        # for each state, the transition already found for each input
+        # transitions only depend on the input so this avoids testing them again
+        self.matched = {}
 
     def add_transition(
         self,
@@ -121,6 +175,8 @@ class FSMachine:
         self.transitions[start_state].append(
             transition_class(end_state, condition, callback)
         )
+        # earlier matches might now be different
+        self.matched.clear()
 
     def run(
         self,
@@ -129,19 +185,29 @@ class FSMachine:
         *args: Any,
         **kwargs: Dict[Any, Any],
     ) -> None:
-        self.current_state = initial_state
-        for c in inputs:
-            self.process_next(c, args, kwargs)
-            # if state is None, early exit
-            if not self.current_state:
-                break
+        # keep the state local so runs on different threads don't interfere
+        lookup = self.lookup
+        state = initial_state
+        if isinstance(inputs, str):
+            state = self.process_string(inputs, state, args, kwargs)
+        else:
+            for c in inputs:
+                state, callback, _ = lookup(state, c)
+                if callback:
+                    callback(*args, c, **kwargs)
+                # if state is None, early exit
+                if not state:
+                    break
 
         # process that we reached the end of the input
-        if self.current_state:
-            self.process_next(None, args, kwargs)
+        if state:
+            state, callback, _ = lookup(state, None)
+            if callback:
+                callback(*args, None, **kwargs)
+        self.current_state = state
 
         # check at a valid end state
-        assert not self.current_state, f"Unexpected ending at {self.current_state}"
+        assert not state, f"Unexpected ending at {state}"
 
     def process_next(
         self,
@@ -149,17 +215,82 @@ class FSMachine:
         callback_args: Any,
         callback_kwargs: Mapping[Any, Any],
     ) -> bool:
-        frozen_state = self.current_state
-        for transition in self.transitions[frozen_state]:
+        destination_state, callback, _ = self.lookup(self.current_state, _input)
+        # update the state
+        self.current_state = destination_state
+        # call the callback, if it exists
+        # because callback uses the last positional argument as the input, the first
+        # positional argment can be used by a class instance as self
+        if callback:
+            callback(*callback_args, _input, **callback_kwargs)
+        # say that we matched this input
+        return True
+
+    def process_string(
+        self,
+        inputs: str,
+        state: Any,
+        callback_args: Any,
+        callback_kwargs: Mapping[Any, Any],
+    ) -> Any:
+        """
+        as process_next for each character of a string, but taking runs of characters at
+        once where a SetInRunTransition or SetNotInRunTransition allows
+
+        returns the state reached
+        """
+        matched = self.matched
+        lookup = self.lookup
+        i = 0
+        end = len(inputs)
+        while i < end:
+            _input = inputs[i]
+            try:
+                state, callback, run_pattern = matched[state][_input]
+            except KeyError:
+                state, callback, run_pattern = lookup(state, _input)
+            if run_pattern:
+                run_end = run_pattern.match(inputs, i).end()  # type: ignore[union-attr]
+                _input = inputs[i:run_end]
+                i = run_end
+            else:
+                i += 1
+            # call the callback, if it exists
+            if callback:
+                callback(*callback_args, _input, **callback_kwargs)
+            # if state is None, early exit
+            if not state:
+                break
+        return state
+
+    def lookup(self, state: Any, _input: Optional[str]) -> Matched:
+        """
+        the destination state, callback, and run pattern of the transition from a state
+        for an input, remembered after the first time
+        """
+        matched = self.matched.get(state)
+        if matched is None:
+            matched = self.matched[state] = {}
+        found = matched.get(_input)
+        if found is None:
+            transition = self.match(state, _input)
+            run_pattern = None
+            if (
+                isinstance(transition, (SetInRunTransition, SetNotInRunTransition))
+                and transition.dst == state
+                and self.transitions[state][0] is transition
+            ):
+                # nothing earlier can match so a whole run goes to this transition
+                run_pattern = transition.run_pattern
+            found = (transition.dst, transition.callback, run_pattern)
+            matched[_input] = found
+        return found
+
+    def match(self, state: Any, _input: Optional[str]) -> Any:
+        """
+        find the first transition from a state that matches the input
+        """
+        for transition in self.transitions[state]:
             if transition.match(_input):
-                # found a transition that matches
-                # update the state
-                self.current_state = transition.dst
-                # call the callback, if it exists
-                # because callback uses the last positional argument as the input, the first
-                # positional argment can be used by a class instance as self
-                if transition.callback:
-                    transition.callback(*callback_args, _input, **callback_kwargs)
-                # say that we matched this input
-                return True
-        raise ValueError(f"Unrecognized input {_input} in state {frozen_state}")
+                return transition
+        raise ValueError(f"Unrecognized input {_input} in state {state}")
@@ -1,3 +1,4 @@
+import collections
 import multiprocessing
 import multiprocessing.connection
 from multiprocessing.connection import Connection
@@ -6,6 +7,8 @@ from types import TracebackType
 from typing import (
     Any,
     Callable,
+    Deque,
+    Dict,
     Generator,
     Iterable,
     List,
@@ -66,11 +69,32 @@ class MultiprocessGeneratorPool:
     subprocs: List[Process]
     pipesparent: List[Connection]
     pipeschild: List[Connection]
-
-    def __init__(self, ncpus: int = multiprocessing.cpu_count()):
+    # submitted function invocations not yet sent to a subprocess
+    pending: Deque[Tuple[Callable[..., Any], int, Mapping[Any, Any]]]
+    # parent pipes of subprocesses not currently running anything
+    idle: List[Connection]
+    # number of function invocations sent to each subprocess not yet finished
+    outstanding: Dict[Connection, int]
+    running: int
+
+    def __init__(
+        self, ncpus: int = multiprocessing.cpu_count(), chunk_fraction: float = 0.5
+    ):
+        """
+        chunk_fraction is the share of the pending invocations, divided between the
+        subprocesses, that is sent to an idle subprocess in one go
+        """
+        if not 0 < chunk_fraction <= 1:
+            raise ValueError(
+                f"chunk_fraction must be above 0 and at most 1 not {chunk_fraction}"
+            )
         self.subprocs = []
         self.pipesparent = []
         self.pipeschild = []
+        self.pending = collections.deque()
+        self.outstanding = {}
+        self.running = 0
+        self.chunk_fraction = chunk_fraction
         for i in range(ncpus):
             pipeparent, pipechild = multiprocessing.Pipe(duplex=True)
             subproc = multiprocessing.Process(
@@ -84,6 +108,7 @@ class MultiprocessGeneratorPool:
         # start them all
         for subproc in self.subprocs:
             subproc.start()
+        self.idle = list(reversed(self.pipesparent))
 
     def __enter__(self) -> Self:
         return self
@@ -110,17 +135,36 @@ class MultiprocessGeneratorPool:
         kwargss: Iterable[Mapping[Any, Any]],
         batchsize: int = 1024,
     ) -> None:
-        i = 0
         for kwargs in kwargss:
-            # send this set of kwarguments
-            self.pipesparent[i].send([func, batchsize, kwargs])
-            # point to the next pipe, wrapping if necessary
-            i = i + 1 if i + 1 < len(self.subprocs) else 0
+            self.pending.append((func, batchsize, kwargs))
+        self._send_pending()
+
+    def _send_pending(self) -> None:
+        # each subprocess is given the next set of kwarguments when it becomes idle
+        # so a slow invocation doesn't hold up others queued behind it
+        while self.pending and self.idle:
+            pipe = self.idle.pop()
+            # send several at once while there is plenty left, to need fewer messages
+            # down to one at a time near the end, to keep the subprocesses evenly loaded
+            count = int(len(self.pending) * self.chunk_fraction / len(self.subprocs))
+            func, batchsize, kwargs = self.pending.popleft()
+            kwargss = [kwargs]
+            # only invocations of the same function can go together
+            while (
+                len(kwargss) < count
+                and self.pending
+                and self.pending[0][0] is func
+                and self.pending[0][1] == batchsize
+            ):
+                kwargss.append(self.pending.popleft()[2])
+            pipe.send([func, batchsize, kwargss])
+            self.outstanding[pipe] = len(kwargss)
+            self.running += len(kwargss)
 
     def results(self) -> Generator[Tuple[Mapping[Any, Any], Any], None, None]:
-        # wait until we have enough sentinels
-        sentinelcount = 0
-        while sentinelcount < len(self.subprocs):
+        # wait until everything submitted has finished
+        self._send_pending()
+        while self.running:
             # check which pipes have data in them
             # process each result pipe in turn
             pipe: Connection
@@ -128,7 +172,11 @@ class MultiprocessGeneratorPool:
                 result = pipe.recv()
                 # we recieved a sentinel value to say that a chunk is complete
                 if result == SENTINEL:
-                    sentinelcount += 1
+                    self.running -= 1
+                    self.outstanding[pipe] -= 1
+                    if not self.outstanding[pipe]:
+                        self.idle.append(pipe)
+                        self._send_pending()
                 elif result[2]:
                     # an exception was raised in a worker
                     # reraise it in the parent
@@ -153,24 +201,25 @@ class MultiprocessGeneratorPool:
                 # received a sentinel message to terminate self
                 break
             else:
-                # start of a new function invocation
-                func, batchsize, kwargs = msg
-                # start a fresh batch of results
-                batch = []
-                try:
-                    for result in func(**kwargs):
-                        batch.append(result)
-                        # batch is full, send it and start a new one
-                        if len(batch) >= batchsize:
-                            pipe.send([kwargs, batch, None])
-                            batch = []
-                except Exception as e:
-                    # if an error happened send it up
-                    pipe.send([kwargs, batch, e])
-                    # continue to the next arg
-                else:
-                    # no error was thrown
-                    # send any leftover lines smaller than a batch
-                    pipe.send([kwargs, batch, None])
-                # send a sentinel to say we've finished an arg
-                pipe.send(SENTINEL)
+                # start of one or more new function invocations
+                func, batchsize, kwargss = msg
+                for kwargs in kwargss:
+                    # start a fresh batch of results
+                    batch = []
+                    try:
+                        for result in func(**kwargs):
+                            batch.append(result)
+                            # batch is full, send it and start a new one
+                            if len(batch) >= batchsize:
+                                pipe.send([kwargs, batch, None])
+                                batch = []
+                    except Exception as e:
+                        # if an error happened send it up
+                        pipe.send([kwargs, batch, e])
+                        # continue to the next arg
+                    else:
+                        # no error was thrown
+                        # send any leftover lines smaller than a batch
+                        pipe.send([kwargs, batch, None])
+                    # send a sentinel to say we've finished an arg
+                    pipe.send(SENTINEL)
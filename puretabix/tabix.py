@@ -1,19 +1,91 @@
+import array
+import functools
 import gzip
+import itertools
 import logging
+import mmap
+import os
 import struct
+import sys
+from collections import OrderedDict
 from io import RawIOBase
-from typing import Dict, Generator, Iterable, List, Tuple, Union
+from typing import Any, Dict, Generator, List, Optional, Sequence, Tuple, Union
 
 from typing_extensions import Self
 
 from puretabix.fsm import FSMachine
 
-from .bgzip import BlockGZipReader
-from .vcf import LINE_START, VCFAccumulator, VCFLine, get_vcf_fsm
+from .bgzip import BlockGZipReader, headersize, headerstruct
+from .vcf import (
+    LINE_START,
+    VCFAccumulator,
+    VCFLine,
+    get_vcf_fsm,
+    parse_vcf_data_line,
+)
 
 logger = logging.getLogger(__name__)
 
 
+# compile once, these are used for every index and every sequence and bin in it
+# the header when reading includes the length of the names that follow
+_header_read_struct = struct.Struct("<4siiiii4sii")
+_header_write_struct = struct.Struct("<4siiiii4si")
+_count_struct = struct.Struct("<i")
+_bin_struct = struct.Struct("<Ii")
+
+
+@functools.lru_cache(maxsize=64)
+def _uint64s_struct(count: int) -> struct.Struct:
+    """
+    Struct for a run of little-endian unsigned 64-bit integers, cached by length.
+    """
+    return struct.Struct(f"<{count}Q")
+
+
+# first key and shift of each level of bins for region_to_bin, smallest first
+_bin_offsets = (4681, 585, 73, 9, 1)
+_bin_shifts = (14, 17, 20, 23, 26)
+
+
+@functools.lru_cache(maxsize=64)
+def _bin_chunks_struct(n_chunks: int) -> struct.Struct:
+    """
+    Struct for a bin key, its number of chunks and their start and end, cached by length.
+    """
+    return struct.Struct(f"<Ii{2 * n_chunks}Q")
+
+
+@functools.lru_cache(maxsize=None)
+def _bin_levels(n_levels: int) -> Tuple[Tuple[int, int], ...]:
+    """
+    For each level of bins, smallest first, the key of the first bin and the shift from a
+    position in units of the smallest bins.
+    """
+    levels = []
+    t = 0
+    s = (n_levels << 1) + n_levels
+    for level in range(n_levels + 1):
+        levels.append((t, s))
+        t += 1 << ((level << 1) + level)
+        s -= 3
+    levels.reverse()
+    return tuple(levels)
+
+
+@functools.lru_cache(maxsize=4096)
+def _region_to_bins(
+    begin_window: int, end_window: int, n_levels: int, min_shift: int
+) -> Tuple[int, ...]:
+    """
+    Keys to bins that *may* overlap the region between two windows of the smallest bin size.
+    """
+    bins: List[int] = []
+    for t, s in _bin_levels(n_levels):
+        bins.extend(range(t + (begin_window >> s), t + (end_window >> s) + 1))
+    return tuple(bins)
+
+
 class TabixIndex:
     def __init__(
         self,
@@ -24,7 +96,7 @@ class TabixIndex:
         meta: str,
         headerlines_count: int,
         indexes: Dict[
-            str, Tuple[Dict[int, Tuple[Tuple[int, int], ...]], Tuple[int, ...]]
+            str, Tuple[Dict[int, Tuple[Tuple[int, int], ...]], Sequence[int]]
         ],
     ):
         """
@@ -50,89 +122,184 @@ class TabixIndex:
 
         # a dictionary of names to (bin_index, interval_index)
         self.indexes = indexes
+        # a dictionary of names to bin numbers to the end of their last chunk
+        # filled in as each sequence is first looked up
+        self.bin_ends: Dict[str, Dict[int, int]] = {}
+
+        self._cache_lookup_virtual_windows()
+
+    def _cache_lookup_virtual_windows(self) -> None:
+        # lookups only depend on which of the smallest bins the region starts and ends in
+        # so cache on that for each index, nearby queries will share results
+        self._lookup_virtual_windows = functools.lru_cache(maxsize=256)(
+            self._lookup_virtual_windows_uncached
+        )
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # the cache can't be pickled, but can be recreated
+        state = self.__dict__.copy()
+        del state["_lookup_virtual_windows"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._cache_lookup_virtual_windows()
+
+    @classmethod
+    def load_once(cls, filename: str) -> Self:
+        """
+        Load the index from a filename, reusing the index from a previous call if the file
+        has not changed since. The same object is returned to every caller, so don't modify it.
+
+        Up to 16 indexes are kept, use clear_load_once to release them.
+        """
+        stat = os.stat(filename)
+        # the class, file identity, and modification time are the key
+        # so subclasses get their own instance and a changed or replaced file is loaded again
+        key = (
+            cls,
+            os.path.abspath(filename),
+            stat.st_dev,
+            stat.st_ino,
+            stat.st_mtime_ns,
+            stat.st_size,
+        )
+        if key in _loaded_indexes:
+            _loaded_indexes.move_to_end(key)
+            index = _loaded_indexes[key]
+        else:
+            with open(filename, "rb") as fileobj:
+                index = cls.from_file(fileobj)  # type: ignore[arg-type]
+            _loaded_indexes[key] = index
+            # evict the least recently used
+            while len(_loaded_indexes) > _loaded_indexes_size:
+                _loaded_indexes.popitem(last=False)
+        assert isinstance(index, cls)
+        return index
+
+    @staticmethod
+    def clear_load_once() -> None:
+        """
+        Release all the indexes kept by load_once.
+        """
+        _loaded_indexes.clear()
 
     @classmethod
     def from_file(cls, fileobj: RawIOBase) -> Self:
         """
         Generally these are pretty small files that need to be read entirely, thus downloading them
         locally before processing is recommented e.g. io.BytesIO
+
+        Real files are memory-mapped rather than read.
         """
         # the index file is block-gzipped but small enough we can
-        # load it into memory and process like a regular gzip file
-        with gzip.GzipFile(fileobj=fileobj) as f:
-            header_pattern = "<4siiiii4sii"
-            header = struct.unpack(
-                header_pattern, f.read(struct.calcsize(header_pattern))
+        # decompress it into memory in one go and parse from there
+        mapped: Optional[mmap.mmap]
+        try:
+            mapped = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            # not a real file e.g. io.BytesIO
+            # or can't be mapped e.g. a pipe or an empty file
+            mapped = None
+        if mapped is not None:
+            # every view of the mapping must be released before it closes
+            # otherwise errors while decompressing are hidden by a BufferError
+            with mapped:
+                with memoryview(mapped) as mapped_view:
+                    with mapped_view[fileobj.tell() :] as data_view:
+                        data = cls._decompress(data_view)
+        else:
+            data = cls._decompress(memoryview(fileobj.read()))
+
+        # view the decompressed data so slicing it doesn't copy
+        # and track where we are up to in it
+        data_view = memoryview(data)
+        offset = 0
+
+        header = _header_read_struct.unpack_from(data_view, offset)
+        offset += _header_read_struct.size
+
+        magic = header[0]
+        if magic != b"TBI\01":  # check magic
+            raise RuntimeError(f"invalid tabix index magic {magic}.")
+
+        # number of named sequences (e.g. chromosomes)
+        n_sequences = header[1]
+
+        file_format = header[2]
+        # 0 = generic tab-delemited
+        # 1 = SAM
+        # 2 = VCF
+        if file_format not in (0, 1, 2):
+            raise RuntimeError(f"invalid tabix index format {file_format}.")
+
+        # these are 1 based
+        # value of 0 states not included in file
+        # e.g. VCF has no explicit end column
+        column_sequence = header[3]  # Column for the sequence name
+        column_begin = header[4]  # Column for the start of a region
+        column_end = header[5]  # Column for the end of a region
+
+        # this is the comment marker, usually #
+        meta = header[6].decode("ascii")[0]
+        assert meta == "#", (header[6], meta)
+
+        # number of lines of header at the start of the file
+        # this does not include lines marked as comments
+        headerlines_count = header[7]
+
+        # sequence names are a series of bytes followed by a null byte
+        # drop the last null and decode them all at once before splitting
+        names_concat = data_view[offset : offset + header[8] - 1]
+        names = tuple(str(names_concat, "utf-8").split("\x00")) if n_sequences else ()
+        offset += header[8]
+        if len(names) != n_sequences:
+            raise RuntimeError(
+                f"unexpected number of sequences {n_sequences} vs {len(names)}"
             )
 
-            magic = header[0]
-            if magic != b"TBI\01":  # check magic
-                raise RuntimeError(f"invalid tabix index magic {magic}.")
-
-            # number of named sequences (e.g. chromosomes)
-            n_sequences = header[1]
-
-            file_format = header[2]
-            # 0 = generic tab-delemited
-            # 1 = SAM
-            # 2 = VCF
-            if file_format not in (0, 1, 2):
-                raise RuntimeError(f"invalid tabix index format {file_format}.")
-
-            # these are 1 based
-            # value of 0 states not included in file
-            # e.g. VCF has no explicit end column
-            column_sequence = header[3]  # Column for the sequence name
-            column_begin = header[4]  # Column for the start of a region
-            column_end = header[5]  # Column for the end of a region
-
-            # this is the comment marker, usually #
-            meta = header[6].decode("ascii")[0]
-            assert meta == "#", (header[6], meta)
-
-            # number of lines of header at the start of the file
-            # this does not include lines marked as comments
-            headerlines_count = header[7]
-
-            # sequence names are a series of bytes followed by a null byte
-            names = tuple(
-                map(bytes.decode, f.read(header[8]).split(b"\x00")[:-1])
-            )  # throw the last empty one away
-            if len(names) != n_sequences:
-                raise RuntimeError(
-                    f"unexpected number of sequences {n_sequences} vs {len(names)}"
+        indexes: Dict[
+            str, Tuple[Dict[int, Tuple[Tuple[int, int], ...]], Sequence[int]]
+        ] = {}
+        count_unpack_from = _count_struct.unpack_from
+        bin_unpack_from = _bin_struct.unpack_from
+        # for each sequence
+        for name in names:
+            # each sequence has a bin index and an interval index
+
+            # parse the bin index
+            n_bins = count_unpack_from(data_view, offset)[0]
+            offset += 4
+            bins: Dict[int, Tuple[Tuple[int, int], ...]] = {}
+            for _ in range(n_bins):
+                # each bin has a key, and a series of chunks
+                bin_key, n_chunks = bin_unpack_from(data_view, offset)
+                offset += 8
+                # unpack all the chunks in one go then pair up starts and ends
+                chunks_flat = _uint64s_struct(2 * n_chunks).unpack_from(
+                    data_view, offset
                 )
-
-            indexes: Dict[
-                str, Tuple[Dict[int, Tuple[Tuple[int, int], ...]], Tuple[int, ...]]
-            ] = {}
-            # for each sequence
-            for name in names:
-                # each sequence has a bin index and an interval index
-
-                # parse the bin index
-                n_bins = struct.unpack("<i", f.read(4))[0]
-                bins: Dict[int, Tuple[Tuple[int, int], ...]] = {}
-                for _ in range(n_bins):
-                    # each bin has a key, and a series of chunks
-                    bin_key, n_chunks = struct.unpack("<Ii", f.read(8))
-                    chunks: Tuple[Tuple[int, int], ...] = tuple(
-                        (i, j)
-                        for i, j in struct.iter_unpack("<QQ", f.read(16 * n_chunks))
-                    )
-
-                    assert bin_key not in bins
-                    bins[bin_key] = chunks
-
-                # parse the interval index
-                n_intervals = struct.unpack("<i", f.read(4))[0]
-                intervals: Tuple[int, ...] = tuple(
-                    i[0] for i in struct.iter_unpack("<Q", f.read(8 * n_intervals))
+                chunks: Tuple[Tuple[int, int], ...] = tuple(
+                    zip(chunks_flat[0::2], chunks_flat[1::2])
                 )
+                offset += 16 * n_chunks
 
-                if name in indexes:
-                    raise RuntimeError(f"duplicate sequence name {name}")
-                indexes[name] = (bins, intervals)
+                assert bin_key not in bins
+                bins[bin_key] = chunks
+
+            # parse the interval index
+            n_intervals = count_unpack_from(data_view, offset)[0]
+            offset += 4
+            # keep as a compact array of machine integers rather than python ints
+            intervals = array.array("Q")
+            intervals.frombytes(data_view[offset : offset + 8 * n_intervals])
+            if sys.byteorder != "little":
+                intervals.byteswap()
+            offset += 8 * n_intervals
+
+            if name in indexes:
+                raise RuntimeError(f"duplicate sequence name {name}")
+            indexes[name] = (bins, intervals)
 
         return cls(
             file_format,
@@ -144,6 +311,24 @@ class TabixIndex:
             indexes,
         )
 
+    @staticmethod
+    def _decompress(data: memoryview) -> bytes:
+        """
+        Decompress the whole of an index file that is in memory.
+
+        Index files are block-gzipped, so each block is decompressed directly from the buffer.
+        Anything else is treated as a regular gzip file.
+        """
+        if len(data) < headersize or not BlockGZipReader.check_is_header(
+            headerstruct.unpack_from(data)
+        ):
+            # gzip keeps slices of its input, so give it a copy rather than the view
+            return gzip.decompress(bytes(data))
+        return b"".join(
+            decompressed
+            for _, decompressed in BlockGZipReader.generate_buffer_blocks(data)
+        )
+
     def __repr__(self) -> str:
         return f"{self.__class__.__name__}({self.file_format}, {self.column_sequence}, {self.column_begin}, {self.column_end}, {self.meta}, {self.headerlines_count}, {self.indexes})"
 
@@ -160,86 +345,104 @@ class TabixIndex:
         # throw away the first 14 bits to get index position
         i = start >> 14
         # if this sequence_name isn't valid, say that
-        if sequence_name not in self.indexes:
+        # use a single lookup rather than checking membership first
+        index = self.indexes.get(sequence_name)
+        if index is None:
             return None
-        linear_index = self.indexes[sequence_name][1]
+        linear_index = index[1]
         # if it would be beyond the index, say that
         if i >= len(linear_index):
             return None
         # its a valid sequnce name and a valid interval window
         return linear_index[i]
 
-    def _lookup_bin_chunks(
-        self, sequence_name: str, start: int, end: int
-    ) -> Generator[Tuple[int, int], None, None]:
+    def _lookup_bin_ends(self, sequence_name: str) -> Dict[int, int]:
         """
-        Records are assigned to a bin if the entirely fit in the bin.
-        So we want all the records in all the bins that overlap with the region of interest.
-        These records *might* overlap with the region of interest.
+        For each bin of a sequence, the furthest end of any of its chunks.
         """
-        bin_index = self.indexes[sequence_name][0]
-        for chunks_bin_index in reversed(tuple(self.region_to_bins(start, end))):
-            if chunks_bin_index in bin_index:
-                for chunk in bin_index[chunks_bin_index]:
-                    yield chunk
+        bin_ends = self.bin_ends.get(sequence_name)
+        if bin_ends is None:
+            bin_ends = {
+                bin_i: max(chunk_end for _, chunk_end in chunks)
+                for bin_i, chunks in self.indexes[sequence_name][0].items()
+                if chunks
+            }
+            self.bin_ends[sequence_name] = bin_ends
+        return bin_ends
 
     def lookup_virtual(
         self, sequence_name: str, start: int, end: int
     ) -> Union[Tuple[None, None], Tuple[int, int]]:
-        virtual_start = None
-        virtual_end = None
+        return self._lookup_virtual_windows(sequence_name, start >> 14, end >> 14)
+
+    def _lookup_virtual_windows_uncached(
+        self, sequence_name: str, start_window: int, end_window: int
+    ) -> Union[Tuple[None, None], Tuple[int, int]]:
+        """
+        Lookup the virtual offsets of a region in terms of the 16kb windows it starts and ends in.
 
-        linear_start = self._lookup_linear(sequence_name, start)
+        Both the linear index and the bins work at this granularity so nothing is lost.
+        """
+        linear_start = self._lookup_linear(sequence_name, start_window << 14)
         # if this is not in the linear index, cant return anything
         if not linear_start:
             return None, None
 
-        for chunk_start, chunk_end in self._lookup_bin_chunks(
-            sequence_name, start, end
-        ):
-            if chunk_end <= linear_start:
-                # if the chunk finished before this section of the linear starts, skip the chunk
-                # rare, but does happen sometimes
+        # Records are assigned to a bin if the entirely fit in the bin.
+        # So we want all the records in all the bins that overlap with the region of interest.
+        # These records *might* overlap with the region of interest.
+        bin_index = self.indexes[sequence_name][0]
+        bin_ends = self._lookup_bin_ends(sequence_name)
+
+        # every chunk start is moved to where the linear start begins if it is later
+        # so the overall start can be no later than the linear start
+        virtual_start = linear_start
+        # any chunk that is used ends after the linear start, so zero means none found
+        virtual_end = 0
+        for bin_i in _region_to_bins(start_window, end_window, 5, 14):
+            # most candidate bins are empty, so only look each one up once
+            # bins that end before the linear start don't need their chunks checked
+            if bin_ends.get(bin_i, 0) <= linear_start:
                 continue
+            for chunk_start, chunk_end in bin_index[bin_i]:
+                if chunk_end <= linear_start:
+                    # if the chunk finished before this section of the linear starts, skip the chunk
+                    # rare, but does happen sometimes
+                    continue
+                if chunk_start < virtual_start:
+                    virtual_start = chunk_start
+                if chunk_end > virtual_end:
+                    virtual_end = chunk_end
+
+        # no chunks overlap
+        if not virtual_end:
+            return None, None
 
-            # move the chunk start to where the linear start begins
-            chunk_start = min(chunk_start, linear_start)
-
-            if virtual_start is None or chunk_start < virtual_start:
-                virtual_start = chunk_start
-
-            if virtual_end is None or chunk_end > virtual_end:
-                virtual_end = chunk_end
-
-        # either both or neither must be set
-        assert (virtual_start is None) == (virtual_end is None)
-        assert (virtual_start is not None) == (virtual_end is not None)
-
-        return virtual_start, virtual_end  # type: ignore
+        return virtual_start, virtual_end
 
     def write_to(self, outfile: RawIOBase) -> None:
+        # build up the whole index in memory and write it in one go
+        # rather than many small writes
+        buffer = bytearray()
+
         # header
-        outfile.write(
-            struct.pack(
-                "<4siiiii4si",
-                b"TBI\01",  # magic number
-                len(self.indexes),  # n sequences
-                self.file_format,  # file format 0 generic, 1 sam, 2 vcf
-                self.column_sequence,  # column for sequence ids, 1-based
-                self.column_begin,  # column for region start, 1-based
-                self.column_end,  # column for region end, 1-based
-                self.meta.encode("ascii")
-                + b"\x00\x00\x00",  # this is a character, but represented as a int
-                self.headerlines_count,
-            )
+        buffer += _header_write_struct.pack(
+            b"TBI\01",  # magic number
+            len(self.indexes),  # n sequences
+            self.file_format,  # file format 0 generic, 1 sam, 2 vcf
+            self.column_sequence,  # column for sequence ids, 1-based
+            self.column_begin,  # column for region start, 1-based
+            self.column_end,  # column for region end, 1-based
+            self.meta.encode("ascii")
+            + b"\x00\x00\x00",  # this is a character, but represented as a int
+            self.headerlines_count,
         )
 
         # length of concatenated zero terminated names
         names = tuple(self.indexes.keys())  # ensure consistent order
         names_concat = b"".join((i.encode("ascii") + b"\0" for i in names))
-        outfile.write(
-            struct.pack(f"<i{len(names_concat)}s", len(names_concat), names_concat)
-        )
+        buffer += _count_struct.pack(len(names_concat))
+        buffer += names_concat
 
         for name in names:
             # n_bin
@@ -250,17 +453,26 @@ class TabixIndex:
             # n_intv
             #   ioff
             bin_index = self.indexes[name][0]
-            outfile.write(struct.pack("<i", len(bin_index)))
-            for bin_i in bin_index.keys():
-                # unsigned bin number, n_chunk
-                outfile.write(struct.pack("<Ii", bin_i, len(bin_index[bin_i])))
-                for chunk_begin, chunk_end in bin_index[bin_i]:
-                    outfile.write(struct.pack("<QQ", chunk_begin, chunk_end))
+            buffer += _count_struct.pack(len(bin_index))
+            for bin_i, chunks in bin_index.items():
+                # unsigned bin number, n_chunk, then the flattened chunks all in one go
+                buffer += _bin_chunks_struct(len(chunks)).pack(
+                    bin_i, len(chunks), *itertools.chain.from_iterable(chunks)
+                )
 
             intv_index = self.indexes[name][1]
-            outfile.write(struct.pack("<i", len(intv_index)))
-            for ioff in intv_index:
-                outfile.write(struct.pack("<Q", ioff))
+            buffer += _count_struct.pack(len(intv_index))
+            if (
+                isinstance(intv_index, array.array)
+                and intv_index.typecode == "Q"
+                and sys.byteorder == "little"
+            ):
+                # already laid out as they are written, so copy them directly
+                buffer += intv_index.tobytes()
+            else:
+                buffer += _uint64s_struct(len(intv_index)).pack(*intv_index)
+
+        outfile.write(buffer)
 
     @classmethod
     def build_from(cls, rawfile: RawIOBase) -> Self:
@@ -273,24 +485,29 @@ class TabixIndex:
         column_begin = 2  # column for region start, 1-based
         column_end = 0  # column for region end, 1-based
         meta = "#"
+        meta_bytes = meta.encode("ascii")
 
         # dictionary of names to (bin_index, interval_index)
-        # bin_index is a dictionary of bin numbers to [(chunk_start, chunk_end),...]
-        # interval_index is a list of 16kbase interval start locations
-        indexes: Dict[str, Tuple[Dict[int, List[Tuple[int, int]]], List[int]]] = {}
-
-        # go through each line in turn
-        # parse it into a structured object
-        vcf_fsm = get_vcf_fsm()
-        accumulator = VCFAccumulator()
+        # bin_index is a dictionary of bin numbers to [chunk_start, chunk_end, ...]
+        # interval_index is an array of 16kbase interval start locations
+        # both are kept as flat arrays of machine integers while building
+        # rather than creating a tuple object for every chunk
+        indexes: Dict[
+            str, Tuple[Dict[int, "array.array[int]"], "array.array[int]"]
+        ] = {}
 
         # these are the internal two index types
-        bin_index = {}
-        interval_index: List[int] = []
+        bin_index: Dict[int, "array.array[int]"] = {}
+        interval_index: "array.array[int]" = array.array("Q")
 
         bgzipped = BlockGZipReader(rawfile)
         bgzipped.seek(0)
 
+        # bind once rather than looking it up on the class for every line
+        region_to_bin = cls.region_to_bin
+
+        # go through each line in turn
+        # only the position and length of the record is needed, not a fully parsed line
         for (
             start_block,
             start_offset,
@@ -298,49 +515,47 @@ class TabixIndex:
             end_offset,
             line,
         ) in bgzipped.generate_lines_offset():
-            line_str = line.decode() + "\n"
-            vcf_fsm.run(line_str, LINE_START, accumulator)
-            vcf_line = accumulator.to_vcfline()
-            accumulator.reset()
-            # TODO add better debugging for unexpected lines
-
             # skip any comment lines with # or ##
-            if vcf_line.comment_raw or vcf_line.comment_key:
+            # check the raw bytes so comments are never decoded or parsed
+            if line.startswith(meta_bytes):
                 continue
 
+            # chrom, pos, id, ref are the first four columns so split no further
+            # this avoids running the full vcf parser on every line
+            chrom_bytes, pos_bytes, _, ref, _ = line.split(b"\t", 4)
+            chrom = chrom_bytes.decode()
+            pos = int(pos_bytes)
+            # TODO add better debugging for unexpected lines
+
             # have we started a new chromosome?
-            if vcf_line.chrom not in indexes:
-                chrom_bin_index: Dict[int, List[Tuple[int, int]]] = {}
-                chrom_interval_index: List[int] = []
-                indexes[vcf_line.chrom] = (chrom_bin_index, chrom_interval_index)
-                bin_index = indexes[vcf_line.chrom][0]
-                interval_index = indexes[vcf_line.chrom][1]
+            if chrom not in indexes:
+                bin_index = {}
+                interval_index = array.array("Q")
+                indexes[chrom] = (bin_index, interval_index)
 
             # get the combined number for the block & offset
             start_virtual = start_block << 16 | start_offset
             end_virtual = end_block << 16 | end_offset
 
             # subtract 1 because its 0 offset
-            record_start = vcf_line.pos - 1
+            record_start = pos - 1
             # subtract another 1 because half-open end
-            record_end = vcf_line.pos - 1 + len(vcf_line.ref) - 1
+            record_end = pos - 1 + len(ref) - 1
 
             # bin index
             # smallest bin that completely contains the record
 
-            bin_i = cls.region_to_bin(record_start, record_end)
+            bin_i = region_to_bin(record_start, record_end)
 
-            if bin_i not in bin_index.keys():
-                bin_index[bin_i] = [(start_virtual, end_virtual + 1)]
-            else:
+            chunks = bin_index.get(bin_i)
+            if chunks is None:
+                bin_index[bin_i] = array.array("Q", (start_virtual, end_virtual + 1))
+            elif chunks[-1] == start_virtual:
                 # extend chunk if directly continuous
-                if bin_index[bin_i][-1][1] == start_virtual:
-                    bin_index[bin_i][-1] = (
-                        bin_index[bin_i][-1][0],
-                        end_virtual + 1,
-                    )
-                else:
-                    bin_index[bin_i].append((start_virtual, end_virtual + 1))
+                chunks[-1] = end_virtual + 1
+            else:
+                chunks.append(start_virtual)
+                chunks.append(end_virtual + 1)
 
             # interval index
             # is the lowest virtual offset of all records that overlap interval
@@ -348,25 +563,30 @@ class TabixIndex:
 
             # throw away the first 14 bits to get interval index
             # e.g. 0 => 0, 16384 => 1, etc
-            interval_i = record_start >> 14
+            # a record may overlap more than one interval so go up to its end
+            interval_i_end = record_end >> 14
 
             # line fully in block
-            if start_block == end_block:
-                # pad if necessary
-                while len(interval_index) <= interval_i:
-                    interval_index.append(start_virtual)
+            if start_block == end_block and len(interval_index) <= interval_i_end:
+                # pad in a single step
+                # earlier intervals already have a lower offset so never need revisiting
+                interval_index.extend(
+                    [start_virtual] * (interval_i_end + 1 - len(interval_index))
+                )
 
         # now they have been built, freeze into immutability
-        # turn Dict[str, Tuple[Dict[int, List[ Tuple[int, int]]]     , List[int]]]
-        # into Dict[str, Tuple[Dict[int, Tuple[Tuple[int, int], ...]], Tuple[int, ...]]]
+        # turn Dict[str, Tuple[Dict[int, array[int]]                   , array[int]]]
+        # into Dict[str, Tuple[Dict[int, Tuple[Tuple[int, int], ...]], array[int]]]
+        # the linear index is stored unboxed, the same as when read from a file
         indexes_frozen: Dict[
-            str, Tuple[Dict[int, Tuple[Tuple[int, int], ...]], Tuple[int, ...]]
+            str, Tuple[Dict[int, Tuple[Tuple[int, int], ...]], Sequence[int]]
         ] = {}
         for chrom in indexes:
             bin_index_frozen: Dict[int, Tuple[Tuple[int, int], ...]] = {}
-            for i in indexes[chrom][0]:
-                bin_index_frozen[i] = tuple(indexes[chrom][0][i])
-            interval_index_frozen = tuple(indexes[chrom][1])
+            for i, chunks in indexes[chrom][0].items():
+                # pair up the flat starts and ends
+                bin_index_frozen[i] = tuple(zip(chunks[0::2], chunks[1::2]))
+            interval_index_frozen = indexes[chrom][1]
             indexes_frozen[chrom] = (bin_index_frozen, interval_index_frozen)
 
         return cls(
@@ -382,26 +602,21 @@ class TabixIndex:
     @staticmethod
     def region_to_bins(
         begin: int, end: int, n_levels: int = 5, min_shift: int = 14
-    ) -> Generator[int, None, None]:
+    ) -> Tuple[int, ...]:
         """
-        generator of keys to bins of records which *may* overlap the given region
+        keys to bins of records which *may* overlap the given region,
+        smallest bins first
 
         n_levels: int, optional
             cluster level, 5 for tabix
         min_shift: int, optional
             minimum shift, 14 for tabix
         """
-        t = 0
-        s = min_shift + (n_levels << 1) + n_levels
-        for level in range(n_levels + 1):
-            b = t + (begin >> s)
-            e = t + (end >> s)
-            n = e - b + 1
-            for k in range(b, e + 1):
-                yield k
-                n += 1
-            t += 1 << ((level << 1) + level)
-            s -= 3
+        # only which of the smallest bins the region is in matters
+        # so use that to share the cached results between nearby regions
+        return _region_to_bins(
+            begin >> min_shift, end >> min_shift, n_levels, min_shift
+        )
 
     @staticmethod
     def region_to_bin(begin: int, end: int) -> int:
@@ -409,17 +624,12 @@ class TabixIndex:
         returns the index of the smallest bin that contains the region
         as a half-closed half-open interval
         """
-        if begin >> 14 == end >> 14:
-            return ((1 << 15) - 1) // 7 + (begin >> 14)
-        elif begin >> 17 == end >> 17:
-            return ((1 << 12) - 1) // 7 + (begin >> 17)
-        elif begin >> 20 == end >> 20:
-            return ((1 << 9) - 1) // 7 + (begin >> 20)
-        elif begin >> 23 == end >> 23:
-            return ((1 << 6) - 1) // 7 + (begin >> 23)
-        elif begin >> 26 == end >> 26:
-            return ((1 << 3) - 1) // 7 + (begin >> 26)
-        return 0
+        # the highest bit that differs decides which level of bin holds both ends
+        # every level is 3 bits above the one below, starting at 14 bits
+        level = (((begin ^ end) >> 14).bit_length() + 2) // 3
+        if level >= len(_bin_offsets):
+            return 0
+        return _bin_offsets[level] + (begin >> _bin_shifts[level])
 
     @staticmethod
     def bin_start(k: int) -> int:
@@ -438,24 +648,65 @@ class TabixIndex:
         return sl
 
 
+# indexes kept by TabixIndex.load_once, most recently used last
+_loaded_indexes: "OrderedDict[Tuple[type, str, int, int, int, int], TabixIndex]" = (
+    OrderedDict()
+)
+_loaded_indexes_size = 16
+
+
 class TabixIndexedFile:
+    meta_bytes: bytes
+    min_cols: int
+    col_begin: int
+    col_end: int
+    # decompressed block and the offset of the block after it, if known
+    block_cache: "OrderedDict[int, Tuple[bytes, Optional[int]]]"
+    # blocks are up to 64kb decompressed, so this is up to 1mb
+    block_cache_size: int = 16
+
     def __init__(self, fileobj: RawIOBase, index: TabixIndex):
         self.index = index
         self.bgzipped = BlockGZipReader(fileobj)
+        self.block_cache = OrderedDict()
+
+        # these are fixed by the index so work them out once rather than every fetch
+        # meta is a single character so compare against the first byte
+        self.meta_bytes = index.meta.encode("ascii")
+        # filter lines of wrong lengths i.e. cut off around chunk boundries
+        self.min_cols = max(index.column_sequence, index.column_begin, index.column_end)
+        # filter lines before start and after end
+        # columns are 1-based in the index
+        self.col_begin = index.column_begin - 1
+        # default to using begin column again
+        self.col_end = (
+            index.column_end if index.column_end else index.column_begin
+        ) - 1
 
     @classmethod
     def from_files(cls, fileobj: RawIOBase, index_fileobj: RawIOBase) -> Self:
         return cls(fileobj, TabixIndex.from_file(index_fileobj))
 
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Releases the memory-mapping of the file and any cached blocks.
+        The underlying file is left open.
+        """
+        self.bgzipped.close()
+        self.block_cache.clear()
+
     def fetch_bytes_block_offset(
         self, block_start: int, offset_start: int, block_end: int, offset_end: int
     ) -> bytes:
-        value = b""
-        self.bgzipped.seek(block_start)
-        block = block_start
-        while block <= block_end:
-            _, _, decompressed, _ = self.bgzipped.get_block()
-            # print(decompressed)
+        # collect the pieces and join once, rather than growing a bytes object
+        parts: List[bytes] = []
+        for block, decompressed in self.generate_blocks(block_start, block_end):
             # empty block at end of file
             if not decompressed:
                 break
@@ -466,10 +717,43 @@ class TabixIndexedFile:
             if block == block_start:
                 # start block, drop before offset start
                 decompressed = decompressed[offset_start:]
-            value = value + decompressed
-            # update ready for next loop
-            block = self.bgzipped.tell()
-        return value
+            parts.append(decompressed)
+        return b"".join(parts)
+
+    def generate_blocks(
+        self, block_start: int, block_end: int
+    ) -> Generator[Tuple[int, bytes], None, None]:
+        """
+        generator that yields the file offset and decompressed content of each block from
+        the start block up to and including the block that starts at the end
+
+        recently used blocks are kept and reused, as nearby fetches often need the same blocks
+        """
+        block_cache = self.block_cache
+        block = block_start
+        # use cached blocks for as long as they cover the range
+        while block in block_cache:
+            decompressed, next_block = block_cache[block]
+            # need to read this block again to find where the next one starts
+            if next_block is None and decompressed and block < block_end:
+                break
+            block_cache.move_to_end(block)
+            yield block, decompressed
+            if not decompressed or next_block is None or next_block > block_end:
+                return
+            block = next_block
+
+        # read the rest from the file, keeping each block and where the next one starts
+        self.bgzipped.seek(block)
+        previous: Union[None, Tuple[int, bytes]] = None
+        for block, decompressed in self.bgzipped.generate_blocks(block_end):
+            if previous is not None:
+                block_cache[previous[0]] = (previous[1], block)
+            block_cache[block] = (decompressed, None)
+            if len(block_cache) > self.block_cache_size:
+                block_cache.popitem(last=False)
+            previous = (block, decompressed)
+            yield block, decompressed
 
     def fetch_bytes_virtual(self, virtual_start: int, virtual_end: int) -> bytes:
         # the lower 16 bits store the offset of the byte inside the gzip block
@@ -520,40 +804,27 @@ class TabixIndexedFile:
         region = self.fetch_bytes(name, start, end)
         # no region, no lines
         if not region:
-            return ("" for _ in [])
-
-        # turn the bytes into a list of strings
-        lines: Iterable[str] = region.decode("utf-8").splitlines()
-
-        # filter out comments
-        lines = (line for line in lines if not line.startswith(self.index.meta))
-
-        # split lines
-        lines_split = ((line, line.split("\t")) for line in lines)
-
-        # filter lines of wrong lengths i.e. cut off around chunk boundries
-        expected_len = max(
-            self.index.column_sequence,
-            self.index.column_begin,
-            self.index.column_end,
-        )
-
-        # filter lines before start and after end
-        column_begin = self.index.column_begin
-        # default to using begin column again
-        column_end = (
-            self.index.column_end if self.index.column_end else self.index.column_begin
-        )
-
-        return (
-            line
-            for line, line_split in lines_split
+            return
+
+        # look these up once rather than for every line
+        meta_bytes = self.meta_bytes
+        min_cols = self.min_cols
+        col_begin = self.col_begin
+        col_end = self.col_end
+
+        # filter on the raw bytes and only decode the lines that are kept
+        for line in region.splitlines():
+            # filter out comments
+            if line[:1] == meta_bytes:
+                continue
+            # only split as far as the columns that are needed
+            line_split = line.split(b"\t", min_cols)
             if (
-                len(line_split) >= expected_len  # right length
-                and int(line_split[column_begin - 1]) >= start  # after start
-                and int(line_split[column_end - 1]) <= end  # before end
-            )
-        )
+                len(line_split) >= min_cols  # right length
+                and int(line_split[col_begin]) >= start  # after start
+                and int(line_split[col_end]) <= end  # before end
+            ):
+                yield line.decode("utf-8")
 
     def fetch(self, name: str, start: int, end: Union[None, int] = None) -> str:
         """
@@ -561,6 +832,26 @@ class TabixIndexedFile:
         """
         return "\n".join(self.fetch_lines(name, start, end))
 
+    def fetch_many(self, targets: Sequence[Tuple[str, int]]) -> List[str]:
+        """
+        Returns region of interest for each of many (name, position) targets, in the same order
+
+        Targets are fetched in file order so neighbouring targets can reuse the same blocks
+        """
+        index = self.index
+
+        def file_order(i: int) -> int:
+            name, pos = targets[i]
+            if name not in index.indexes:
+                return 0
+            return index.lookup_virtual(name, pos, pos)[0] or 0
+
+        fetched = [""] * len(targets)
+        for i in sorted(range(len(targets)), key=file_order):
+            name, pos = targets[i]
+            fetched[i] = self.fetch(name, pos)
+        return fetched
+
 
 class TabixIndexedVCFFile(TabixIndexedFile):
     accumulator: VCFAccumulator
@@ -578,14 +869,27 @@ class TabixIndexedVCFFile(TabixIndexedFile):
         if not end:
             end = start
 
-        for line in self.fetch_bytes(name, start, end).decode("utf-8").splitlines():
-            try:
-                self.vcf_fsm.run(line, LINE_START, self.accumulator)
-            except ValueError as e:
-                logger.error(f"Error parsing {line}")
-                raise e
-            vcfline = self.accumulator.to_vcfline()
-            self.accumulator.reset()
+        # look these up once rather than for every line
+        meta_bytes = self.meta_bytes
+        accumulator = self.accumulator
+        vcf_fsm_run = self.vcf_fsm.run
+        to_vcfline = accumulator.to_vcfline
+        reset = accumulator.reset
+
+        # split the raw bytes and skip comments before decoding
+        for line_bytes in self.fetch_bytes(name, start, end).splitlines():
+            if line_bytes[:1] == meta_bytes:
+                continue
+            line = line_bytes.decode("utf-8")
+            vcfline = parse_vcf_data_line(line)
+            if vcfline is None:
+                try:
+                    vcf_fsm_run(line, LINE_START, accumulator)
+                except ValueError as e:
+                    logger.error(f"Error parsing {line}")
+                    raise e
+                vcfline = to_vcfline()
+                reset()
             if (
                 vcfline.pos >= start and vcfline.pos <= end
             ):  # after start and before end
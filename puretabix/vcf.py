@@ -1,15 +1,33 @@
+import functools
+import itertools
+import operator
+import sys
 from typing import Dict, Generator, Iterable, List, Mapping, Optional, Tuple
 
 from typing_extensions import Self
 
 from .fsm import (
     FSMachine,
-    RegexTransition,
+    SetInRunTransition,
     SetInTransition,
+    SetNotInRunTransition,
     SetNotInTransition,
 )
 
 
+@functools.lru_cache(maxsize=4096)
+def _split_genotype(gt: str) -> Tuple[Optional[int], ...]:
+    """
+    Split a GT value into allele indexes, with None for a missing allele.
+
+    Cached because the same few genotypes (0/0, 0/1, 1/1 ...) repeat on almost every line.
+    """
+    return tuple(
+        None if allele == "." else int(allele)
+        for allele in gt.replace("|", "/").split("/")
+    )
+
+
 class VCFLine:
     """
     Representation of a single VCF line.
@@ -106,14 +124,18 @@ class VCFLine:
         self._filter = tuple(_filter)
         self.info = dict(info)
         # this may be zero to many
-        self.sample = tuple(dict(s) for s in sample)
+        self.sample = tuple(map(dict, sample))
 
-        try:
-            self.qual = float(qual_str)
-        except ValueError:
-            # if we can't do the conversion, don't worry
-            # value will be None but original in qual_str
+        if not qual_str or qual_str == ".":
+            # missing, so avoid raising and catching an exception
             self.qual = None
+        else:
+            try:
+                self.qual = float(qual_str)
+            except ValueError:
+                # if we can't do the conversion, don't worry
+                # value will be None but original in qual_str
+                self.qual = None
 
     def __str__(self) -> str:
         # CHROM POS ID REF ALT QUAL FILTER INFO (FORMAT) (SAMPLE) (SAMPLE) ...
@@ -142,47 +164,49 @@ class VCFLine:
             )
         else:
             # data line
-            required = "\t".join(
-                (
-                    self.chrom,
-                    str(self.pos),
-                    ";".join(self._id),
-                    self.ref,
-                    ",".join(self.alt),
-                    self.qual_str,  # use non-lossy stored version
-                    ";".join(self._filter),
-                    ";".join(
-                        (
-                            f"{key}={','.join(value)}" if value else key
-                            for key, value in self.info.items()
-                        )
-                        if self.info
-                        else "."
-                    ),
+            # build every column into one list so there is a single join at the end
+            parts = [
+                self.chrom,
+                str(self.pos),
+                ";".join(self._id),
+                self.ref,
+                ",".join(self.alt),
+                self.qual_str,  # use non-lossy stored version
+                ";".join(self._filter),
+                ";".join(
+                    [
+                        f"{key}={','.join(value)}" if value else key
+                        for key, value in self.info.items()
+                    ]
                 )
-            )
-
-            if not self.sample:
-                return required
-            else:
-                # get the superset of all keys of all samples
-                keyset = set()
-                keylist = []
-                for sample in self.sample:
-                    for key in sample.keys():
-                        if key not in keyset:
-                            keylist.append(key)
-                            keyset.add(key)
-                sample_keys = ":".join(keylist)
-                line = "\t".join((required, sample_keys))
-
-                # get the values for each key in superset or .
-                for sample in self.sample:
-                    values = []
-                    for key in keylist:
-                        values.append(sample.get(key, "."))
-                    line = line + "\t" + ":".join(values)
-                return line
+                if self.info
+                else ".",
+            ]
+
+            if self.sample:
+                # get the superset of all keys of all samples, in first seen order
+                keylist = list(
+                    dict.fromkeys(itertools.chain.from_iterable(self.sample))
+                )
+                parts.append(":".join(keylist))
+
+                # usually every sample has every key, so get all the values at once
+                # itemgetter only gives a tuple for more than one key
+                sample_strs: Optional[List[str]] = None
+                if len(keylist) > 1:
+                    get_values = operator.itemgetter(*keylist)
+                    try:
+                        sample_strs = [":".join(get_values(s)) for s in self.sample]
+                    except KeyError:
+                        pass
+                if sample_strs is None:
+                    # get the values for each key in superset or .
+                    sample_strs = [
+                        ":".join([sample.get(key, ".") for key in keylist])
+                        for sample in self.sample
+                    ]
+                parts.extend(sample_strs)
+            return "\t".join(parts)
 
     def __repr__(self) -> str:
         return (
@@ -208,11 +232,11 @@ class VCFLine:
         refalt = (self.ref,) + self.alt
         for i, sample in enumerate(self.sample):
             if "GT" in sample:
-                # split into separate alleles
-                allele_pos = sample["GT"].replace("|", "/").split("/")
                 # for each allele either keep a dot or do ref+alt lookup
-                alleles = [i if i == "." else refalt[int(i)] for i in allele_pos]
-                result[i] = tuple(alleles)
+                result[i] = tuple(
+                    "." if allele is None else refalt[allele]
+                    for allele in _split_genotype(sample["GT"])
+                )
         return tuple(result)
 
     @classmethod
@@ -313,6 +337,13 @@ class VCFAccumulator:
     samples: List[Dict[str, str]]
 
     def __init__(self) -> None:
+        # these are copied by each VCFLine, so they are kept and cleared between lines
+        self._id = []
+        self.alt = []
+        self._filter = []
+        self.info = {}
+        self.format = []
+        self.samples = []
         self.reset()
 
     def reset(self) -> None:
@@ -321,21 +352,22 @@ class VCFAccumulator:
         self.comment_raw = ""
         self.comment_key = ""
         self.comment_value = ""
+        # VCFLine keeps this one rather than copying it, so it must be a new one each line
         self.comment_struct = {}
-        self._comment_struct_key = ""
         self._comment_struct_value = ""
+        self._last_struct_key = ""
         self.chrom = ""
         self.pos = 0
-        self._id = []
+        self._id.clear()
         self.ref = ""
-        self.alt = []
+        self.alt.clear()
         self._alt_option = ""
         self.qual = ""
-        self._filter = []
-        self.info = {}
+        self._filter.clear()
+        self.info.clear()
         self.__infokey = ""
-        self.format = []
-        self.samples = []
+        self.format.clear()
+        self.samples.clear()
 
     def to_vcfline(self) -> VCFLine:
         return VCFLine(
@@ -375,23 +407,23 @@ class VCFAccumulator:
 
     def comment_struct_key_to_comment_struct_value(self, _char: str) -> None:
         comment_struct_key = "".join(self.__characters)
-        assert self._comment_struct_key not in self.comment_struct, (
-            self._comment_struct_key,
-            self.comment_struct,
-        )
+        # an empty key is kept, but nothing can follow it
+        if "" in self.comment_struct:
+            raise ValueError(
+                f"Key {comment_struct_key} after an empty key in structured meta-information"
+            )
         self.comment_struct[comment_struct_key] = None
+        # remember the key for when its value is complete
+        self._last_struct_key = comment_struct_key
         self.__characters = []
 
     def comment_struct_value_to_comment_struct_key(self, _char: str) -> None:
         self._comment_struct_value = "".join(self.__characters)
         self.__characters = []
-        # this needs dict keys to be insertion ordered
-        self.comment_struct[
-            tuple(self.comment_struct.keys())[-1]
-        ] = self._comment_struct_value
+        self.comment_struct[self._last_struct_key] = self._comment_struct_value
 
     def chrom_to_pos(self, _char: str) -> None:
-        self.chrom = "".join(self.__characters)
+        self.chrom = sys.intern("".join(self.__characters))
         self.__characters = []
 
     def pos_to_id(self, _char: str) -> None:
@@ -419,16 +451,16 @@ class VCFAccumulator:
         self.__characters = []
 
     def filter_to_info_key(self, _char: str) -> None:
-        self._filter.append("".join(self.__characters))
+        self._filter.append(sys.intern("".join(self.__characters)))
         self.__characters = []
 
     def info_key_to_info_key(self, _char: str) -> None:
-        self.__infokey = "".join(self.__characters)
+        self.__infokey = sys.intern("".join(self.__characters))
         self.info[self.__infokey] = None
         self.__characters = []
 
     def info_key_to_info_value(self, _char: str) -> None:
-        self.__infokey = "".join(self.__characters)
+        self.__infokey = sys.intern("".join(self.__characters))
         self.__characters = []
 
     def info_value_to_format(self, _char: str) -> None:
@@ -441,16 +473,12 @@ class VCFAccumulator:
         self.__characters = []
 
     def format_to_sample(self, _char: str) -> None:
-        self.format.append("".join(self.__characters))
+        self.format.append(sys.intern("".join(self.__characters)))
         self.__characters = []
 
     def sample_to_sample(self, _char: str) -> None:
         sample_str = "".join(self.__characters)
-        sample_parts = sample_str.split(":")
-        sample = {}
-        for key, value in zip(self.format, sample_parts):
-            sample[key] = value
-        self.samples.append(sample)
+        self.samples.append(dict(zip(self.format, sample_str.split(":"))))
         self.__characters = []
 
 
@@ -476,46 +504,61 @@ INFO_VALUE = "INFO_VALUE"
 FORMAT = "FORMAT"
 SAMPLE = "SAMPLE"
 
+# everything that str.isspace() is true for, same as \s in a regex
+WHITESPACE = (
+    "\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004"
+    "\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000"
+)
+
 
 def get_vcf_fsm() -> FSMachine:
+    """
+    The finite state machine for parsing VCF lines with a VCFAccumulator.
+
+    Each call builds a new machine, so callers can add transitions without affecting others.
+    """
     fsm_vcf = FSMachine()
 
     fsm_vcf.add_transition(
         LINE_START, CHROM, SetNotInTransition, "#", VCFAccumulator.append_character
     )
     fsm_vcf.add_transition(
-        CHROM, CHROM, SetNotInTransition, "\t", VCFAccumulator.append_character
+        CHROM, CHROM, SetNotInRunTransition, "\t", VCFAccumulator.append_character
     )
     # TODO verify CHROM in contig or assembly from comments?
     fsm_vcf.add_transition(
         CHROM, POS, SetInTransition, "\t", VCFAccumulator.chrom_to_pos
     )
     fsm_vcf.add_transition(
-        POS, POS, SetInTransition, "0123456789", VCFAccumulator.append_character
+        POS, POS, SetInRunTransition, "0123456789", VCFAccumulator.append_character
     )
     fsm_vcf.add_transition(POS, ID, SetInTransition, "\t", VCFAccumulator.pos_to_id)
     fsm_vcf.add_transition(
-        ID, ID, RegexTransition, r"\S", VCFAccumulator.append_character
+        ID,
+        ID,
+        SetNotInRunTransition,
+        (*WHITESPACE, None),
+        VCFAccumulator.append_character,
     )
     fsm_vcf.add_transition(ID, ID, SetInTransition, ";", VCFAccumulator.id_to_ref)
     fsm_vcf.add_transition(ID, REF, SetInTransition, "\t", VCFAccumulator.id_to_ref)
     fsm_vcf.add_transition(
-        REF, REF, SetInTransition, "ACGTN", VCFAccumulator.append_character
+        REF, REF, SetInRunTransition, "ACGTN", VCFAccumulator.append_character
     )
     fsm_vcf.add_transition(REF, ALT, SetInTransition, "\t", VCFAccumulator.ref_to_alt)
     fsm_vcf.add_transition(
-        ALT, ALT, SetNotInTransition, ",\t", VCFAccumulator.append_character
+        ALT, ALT, SetNotInRunTransition, ",\t", VCFAccumulator.append_character
     )
     fsm_vcf.add_transition(ALT, ALT, SetInTransition, ",", VCFAccumulator.alt_to_alt)
     fsm_vcf.add_transition(ALT, QUAL, SetInTransition, "\t", VCFAccumulator.alt_to_qual)
     fsm_vcf.add_transition(
-        QUAL, QUAL, SetInTransition, "0123456789.-", VCFAccumulator.append_character
+        QUAL, QUAL, SetInRunTransition, "0123456789.-", VCFAccumulator.append_character
     )
     fsm_vcf.add_transition(
         QUAL, FILTER, SetInTransition, "\t", VCFAccumulator.qual_to_filter
     )
     fsm_vcf.add_transition(
-        FILTER, FILTER, SetNotInTransition, "\t;", VCFAccumulator.append_character
+        FILTER, FILTER, SetNotInRunTransition, "\t;", VCFAccumulator.append_character
     )
     fsm_vcf.add_transition(
         FILTER, FILTER, SetInTransition, ";", VCFAccumulator.filter_to_info_key
@@ -526,7 +569,7 @@ def get_vcf_fsm() -> FSMachine:
     fsm_vcf.add_transition(
         INFO_KEY,
         INFO_KEY,
-        SetNotInTransition,
+        SetNotInRunTransition,
         "=\t;\n",
         VCFAccumulator.append_character,
     )
@@ -553,7 +596,7 @@ def get_vcf_fsm() -> FSMachine:
     fsm_vcf.add_transition(
         INFO_VALUE,
         INFO_VALUE,
-        SetNotInTransition,
+        SetNotInRunTransition,
         "\t;,\n",
         VCFAccumulator.append_character,
     )
@@ -578,7 +621,7 @@ def get_vcf_fsm() -> FSMachine:
         VCFAccumulator.info_value_to_format,
     )
     fsm_vcf.add_transition(
-        FORMAT, FORMAT, SetNotInTransition, "\t:", VCFAccumulator.append_character
+        FORMAT, FORMAT, SetNotInRunTransition, "\t:", VCFAccumulator.append_character
     )
     fsm_vcf.add_transition(
         FORMAT, FORMAT, SetInTransition, ":", VCFAccumulator.format_to_sample
@@ -589,7 +632,7 @@ def get_vcf_fsm() -> FSMachine:
     fsm_vcf.add_transition(
         SAMPLE,
         SAMPLE,
-        SetNotInTransition,
+        SetNotInRunTransition,
         ("\t", "\n", None),
         VCFAccumulator.append_character,
     )
@@ -603,7 +646,7 @@ def get_vcf_fsm() -> FSMachine:
     fsm_vcf.add_transition(
         COMMENT,
         COMMENT,
-        SetNotInTransition,
+        SetNotInRunTransition,
         ("#", "\n", None),
         VCFAccumulator.append_character,
     )
@@ -614,7 +657,7 @@ def get_vcf_fsm() -> FSMachine:
     fsm_vcf.add_transition(
         COMMENT_KEY,
         COMMENT_KEY,
-        SetNotInTransition,
+        SetNotInRunTransition,
         "=",
         VCFAccumulator.append_character,
     )
@@ -628,7 +671,7 @@ def get_vcf_fsm() -> FSMachine:
     fsm_vcf.add_transition(
         COMMENT_VALUE,
         COMMENT_VALUE,
-        SetNotInTransition,
+        SetNotInRunTransition,
         "<\n",
         VCFAccumulator.append_character,
     )
@@ -649,7 +692,7 @@ def get_vcf_fsm() -> FSMachine:
     fsm_vcf.add_transition(
         COMMENT_STRUCT_KEY,
         COMMENT_STRUCT_KEY,
-        SetNotInTransition,
+        SetNotInRunTransition,
         "=",
         VCFAccumulator.append_character,
     )
@@ -663,7 +706,7 @@ def get_vcf_fsm() -> FSMachine:
     fsm_vcf.add_transition(
         COMMENT_STRUCT_VALUE,
         COMMENT_STRUCT_VALUE,
-        SetNotInTransition,
+        SetNotInRunTransition,
         '",>',
         VCFAccumulator.append_character,
     )
@@ -677,7 +720,7 @@ def get_vcf_fsm() -> FSMachine:
     fsm_vcf.add_transition(
         COMMENT_STRUCT_VALUE_QUOTED,
         COMMENT_STRUCT_VALUE_QUOTED,
-        SetNotInTransition,
+        SetNotInRunTransition,
         '"',
         VCFAccumulator.append_character,
     )
@@ -706,25 +749,99 @@ def get_vcf_fsm() -> FSMachine:
     return fsm_vcf
 
 
+@functools.lru_cache(maxsize=None)
+def _get_shared_vcf_fsm() -> FSMachine:
+    # built once and shared within this module, as running it does not change it
+    # the cache of matched transitions is then reused between calls
+    # not exposed, so nothing else can add transitions to it
+    return get_vcf_fsm()
+
+
+def parse_vcf_data_line(line: str) -> Optional[VCFLine]:
+    """
+    Parse a VCF data line by splitting it on tabs, which is much quicker than the finite
+    state machine character by character.
+
+    Gives the same result as the finite state machine would, or None if the line is not
+    one that can be parsed this way (comments, malformed lines, etc) in which case the
+    finite state machine should be used so it can handle or reject the line as normal.
+    """
+    newline_ended = line[-1:] == "\n"
+    if newline_ended:
+        line = line[:-1]
+    # a newline part way through ends the line early in some columns
+    if not line or line[0] in "#\t" or "\n" in line:
+        return None
+    parts = line.split("\t")
+    n_parts = len(parts)
+    # INFO must be ended by a newline if it is the last column
+    # and a FORMAT column must have at least one sample column
+    if n_parts < 8 or (n_parts == 8 and not newline_ended) or n_parts == 9:
+        return None
+    chrom, pos_str, id_str, ref, alt_str, qual_str, filter_str, info_str = parts[:8]
+    # check the same characters as the finite state machine would
+    if not pos_str or pos_str.strip("0123456789"):
+        return None
+    if id_str and id_str.split() != [id_str]:
+        return None
+    if ref.strip("ACGTN") or qual_str.strip("0123456789.-"):
+        return None
+
+    # keys and chromosomes repeat on every line so share one copy of each
+    intern = sys.intern
+    info: Dict[str, Optional[List[str]]] = {}
+    for info_part in info_str.split(";"):
+        key, equals, value = info_part.partition("=")
+        key = intern(key)
+        if not equals:
+            info[key] = None
+        else:
+            values = info.get(key)
+            if values is None:
+                info[key] = value.split(",")
+            else:
+                values.extend(value.split(","))
+
+    samples: List[Dict[str, str]] = []
+    if n_parts > 9:
+        format_ = list(map(intern, parts[8].split(":")))
+        samples = [dict(zip(format_, sample.split(":"))) for sample in parts[9:]]
+
+    return VCFLine.as_data(
+        intern(chrom),
+        int(pos_str),
+        (id_str,),
+        ref,
+        alt_str.split(","),
+        qual_str,
+        map(intern, filter_str.split(";")),
+        info,
+        samples,
+    )
+
+
 def read_vcf_lines(
     input_: Iterable[str], header_only: bool = False
 ) -> Generator[VCFLine, None, None]:
     """
     Convenience function for parsing a source of VCF lines
     """
-    vcf_fsm = get_vcf_fsm()
+    vcf_fsm = _get_shared_vcf_fsm()
     accumulator = VCFAccumulator()
     for line in input_:
         if line:
-            vcf_fsm.run(line, LINE_START, accumulator)
-            vcfline = accumulator.to_vcfline()
-            accumulator.reset()
-
             # if we only want to get the initial header
             # and this is not part of the header
-            # then stop
+            # then stop without parsing it
+            # only lines starting with # are comments
             # Note: this does include the vcf column headings (sample names)
-            if not vcfline.is_comment and header_only:
+            if header_only and line[0] != "#":
                 break
 
+            vcfline = parse_vcf_data_line(line)
+            if vcfline is None:
+                vcf_fsm.run(line, LINE_START, accumulator)
+                vcfline = accumulator.to_vcfline()
+                accumulator.reset()
+
             yield vcfline
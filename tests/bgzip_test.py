@@ -1,7 +1,10 @@
+import io
 import os.path
 import tempfile
 
-from puretabix.bgzip import BlockGZipWriter
+import pytest
+
+from puretabix.bgzip import BlockGZipReader, BlockGZipWriter, headersize
 
 
 class TestBlockGZip:
@@ -41,3 +44,88 @@ class TestBlockGZip:
                 line_in = line_in
                 line_out = line_out.decode()
                 assert line_in == line_out, (line_in, line_out)
+
+    def test_generate_blocks_in_memory(self, vcf_filename, vcf_bgzreader):
+        # real files are memory-mapped, check other file-likes give the same blocks
+        with open(vcf_filename, "rb") as vcf:
+            memory_reader = BlockGZipReader(io.BytesIO(vcf.read()))
+        # only mapped when blocks are first fetched
+        assert vcf_bgzreader.mapped is None
+
+        end = os.path.getsize(vcf_filename)
+        vcf_bgzreader.seek(0)
+        memory_reader.seek(0)
+        blocks = tuple(vcf_bgzreader.generate_blocks(end))
+        assert len(blocks) > 1
+        assert blocks == tuple(memory_reader.generate_blocks(end))
+        assert vcf_bgzreader.mapped is not None
+        assert memory_reader.mapped is None
+
+        vcf_bgzreader.close()
+        assert vcf_bgzreader.mapped is None
+
+    def test_generate_blocks_grown(self, vcf_gz, tmp_path):
+        # blocks appended after the file was first mapped must still be found
+        content = b"".join(vcf_gz.readlines())
+        with open(tmp_path / "grown.vcf.gz", "wb") as out:
+            out.write(BlockGZipWriter.make_block(content))
+        with open(tmp_path / "grown.vcf.gz", "rb") as grown:
+            with BlockGZipReader(grown) as reader:
+                reader.seek(0)
+                assert tuple(reader.generate_blocks(0)) == ((0, content),)
+                first_size = os.path.getsize(tmp_path / "grown.vcf.gz")
+
+                with open(tmp_path / "grown.vcf.gz", "ab") as out:
+                    out.write(BlockGZipWriter.make_block(content))
+                reader.seek(0)
+                blocks = tuple(reader.generate_blocks(first_size))
+                assert blocks == ((0, content), (first_size, content))
+            assert reader.mapped is None
+
+    def test_write_bgzip_small_writes(self, vcf_gz):
+        # writing line by line must give the same blocks as writing everything at once
+        # repeat the lines so there is more than one block
+        lines = vcf_gz.readlines() * 100
+        assert len(b"".join(lines)) > 65536
+        whole = io.BytesIO()
+        whole_writer = BlockGZipWriter(whole)
+        whole_writer.write(b"".join(lines))
+        whole_writer.flush()
+        parts = io.BytesIO()
+        parts_writer = BlockGZipWriter(parts)
+        for line in lines:
+            parts_writer.write(line)
+        parts_writer.flush()
+        assert whole.getvalue()
+        assert whole.getvalue() == parts.getvalue()
+
+    def test_scan_block_header(self, vcf_gz):
+        # scanning from part way into a block must find the start of the next block
+        lines = vcf_gz.readlines() * 100
+        buffer = io.BytesIO()
+        writer = BlockGZipWriter(buffer)
+        writer.write(b"".join(lines))
+        writer.flush()
+
+        reader = BlockGZipReader(buffer)
+        buffer.seek(0)
+        # last byte, so it doesn't look for a block after the end
+        end = len(buffer.getvalue()) - 1
+        block_starts = [block for block, _ in reader.generate_blocks(end)]
+        assert len(block_starts) > 2
+
+        for block_start, next_block_start in zip(block_starts, block_starts[1:]):
+            # already at a block, only the header is read
+            buffer.seek(block_start)
+            assert reader.scan_block_header()[0] == block_start
+            assert buffer.tell() == block_start + headersize
+
+            buffer.seek(block_start + 1)
+            assert reader.scan_block_header()[0] == next_block_start
+            # left pointing after the header
+            assert buffer.tell() > next_block_start
+
+            # nothing before the end
+            buffer.seek(block_start + 1)
+            with pytest.raises(EOFError):
+                reader.scan_block_header(next_block_start)
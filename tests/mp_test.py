@@ -34,6 +34,31 @@ class TestMultiprocessing:
                 3,
             )
 
+    def test_more_than_workers(self):
+        # each worker takes the next arg when it finishes one
+        with MultiprocessGeneratorPool(2) as pool:
+            pool.submit(myrange, [{"stop": stop} for stop in (1, 4, 2, 3, 1)])
+            results = tuple(sorted((i for _, i in pool.results())))
+            assert results == (0, 0, 0, 0, 0, 1, 1, 1, 2, 2, 3)
+
+    def test_chunks(self):
+        # many args are sent to the workers several at a time
+        with MultiprocessGeneratorPool(2) as pool:
+            pool.submit(myrange, [{"stop": stop % 4} for stop in range(40)])
+            results = tuple(sorted((i for _, i in pool.results())))
+            assert results == (0,) * 30 + (1,) * 20 + (2,) * 10
+
+    def test_chunk_fraction(self):
+        # everything pending can be sent in one go
+        with MultiprocessGeneratorPool(2, chunk_fraction=1) as pool:
+            pool.submit(myrange, [{"stop": stop % 4} for stop in range(40)])
+            results = tuple(sorted((i for _, i in pool.results())))
+            assert results == (0,) * 30 + (1,) * 20 + (2,) * 10
+
+        for chunk_fraction in (0, -0.5, 1.5):
+            with pytest.raises(ValueError):
+                MultiprocessGeneratorPool(2, chunk_fraction=chunk_fraction)
+
     def test_error(self):
         with pytest.raises(Exception):
             with MultiprocessGeneratorPool(2) as pool:
@@ -1,3 +1,11 @@
+import gzip
+import io
+import os
+import pickle
+import random
+import threading
+import zlib
+
 import pytest
 
 import puretabix
@@ -44,6 +52,46 @@ class TestQuery:
         fetched = indexed.fetch("1", 1105365)
         assert fetched == "", fetched
 
+    def test_close(self, indexed):
+        with indexed:
+            assert "rs61733845" in indexed.fetch("1", 1108138)
+            assert indexed.bgzipped.mapped is not None
+        assert indexed.bgzipped.mapped is None
+        assert not indexed.block_cache
+
+    def test_fetch_many(self, indexed):
+        targets = (("1", 1108138), ("1", 100), ("1", 1108138 + 10), ("X", 1))
+        fetched = indexed.fetch_many(targets)
+        assert fetched == [indexed.fetch(name, pos) for name, pos in targets]
+        assert "rs61733845" in fetched[0], fetched
+
+    def test_fetch_cached_blocks(self, indexed):
+        # fetching again uses the blocks kept from the first time
+        fetched = indexed.fetch("1", 1108138)
+        assert indexed.block_cache
+        assert indexed.fetch("1", 1108138) == fetched
+
+    def test_fetch_cached_blocks_many(self):
+        # many blocks, and fewer kept than are needed for some fetches
+        lines = [f"1\t{pos}\t.\tA\tC\t.\tPASS\t.\n" for pos in range(1, 200000, 10)]
+        data = io.BytesIO()
+        writer = puretabix.BlockGZipWriter(data)
+        writer.write("".join(lines).encode())
+        writer.flush()
+        # empty block marks the end of the file
+        data.write(writer.make_block(b""))
+        data.seek(0)
+        index = puretabix.TabixIndex.build_from(data)
+        cached = puretabix.TabixIndexedFile(data, index)
+        cached.block_cache_size = 4
+        random.seed(42)
+        for _ in range(100):
+            start = random.randrange(200000)
+            end = start + random.choice((0, 100, 10000, 100000))
+            expected = puretabix.TabixIndexedFile(data, index).fetch("1", start, end)
+            assert cached.fetch("1", start, end) == expected, (start, end)
+            assert len(cached.block_cache) <= 4
+
 
 class TestCreatedQuery(TestQuery):
     # subclass the query tests
@@ -58,3 +106,145 @@ class TestCreatedQuery(TestQuery):
     def indexed_vcf(self, vcf):
         idx = puretabix.TabixIndex.build_from(vcf)
         return puretabix.TabixIndexedVCFFile(vcf, idx)
+
+
+class TestIndex:
+    def test_from_file_in_memory(self, vcf_tbi):
+        # real files are memory-mapped, check other file-likes give the same index
+        idx_file = puretabix.TabixIndex.from_file(vcf_tbi)
+        vcf_tbi.seek(0)
+        idx_memory = puretabix.TabixIndex.from_file(io.BytesIO(vcf_tbi.read()))
+        assert repr(idx_file) == repr(idx_memory)
+
+    def test_from_file_pipe(self, vcf_tbi):
+        # pipes can't be memory-mapped so are read instead
+        idx_file = puretabix.TabixIndex.from_file(vcf_tbi)
+        vcf_tbi.seek(0)
+        data = vcf_tbi.read()
+        read_fd, write_fd = os.pipe()
+
+        def write_all():
+            with open(write_fd, "wb") as pipe_write:
+                pipe_write.write(data)
+
+        with open(read_fd, "rb") as pipe_read:
+            # write from another thread so a full pipe doesn't block
+            writer = threading.Thread(target=write_all)
+            writer.start()
+            idx_pipe = puretabix.TabixIndex.from_file(pipe_read)
+            writer.join()
+        assert repr(idx_file) == repr(idx_pipe)
+
+    def test_from_file_corrupt(self, vcf_tbi, tmp_path):
+        # the decompression error is raised, not hidden by the memory-mapping closing
+        data = bytearray(vcf_tbi.read())
+        data[30] ^= 0xFF
+        data[31] ^= 0xFF
+        (tmp_path / "corrupt.tbi").write_bytes(data)
+        with open(tmp_path / "corrupt.tbi", "rb") as corrupt:
+            with pytest.raises(zlib.error):
+                puretabix.TabixIndex.from_file(corrupt)
+
+    def test_from_file_truncated(self, vcf_tbi, tmp_path):
+        data = vcf_tbi.read()
+        (tmp_path / "truncated.tbi").write_bytes(data[: len(data) // 2])
+        with open(tmp_path / "truncated.tbi", "rb") as truncated:
+            with pytest.raises(EOFError):
+                puretabix.TabixIndex.from_file(truncated)
+        with pytest.raises(EOFError):
+            puretabix.TabixIndex.from_file(io.BytesIO(data[: len(data) // 2]))
+
+    def test_load_once(self, vcf_filename, vcf_tbi):
+        # loading the same unchanged file again gives the same object
+        idx = puretabix.TabixIndex.load_once(vcf_filename + ".tbi")
+        assert idx is puretabix.TabixIndex.load_once(vcf_filename + ".tbi")
+        assert repr(idx) == repr(puretabix.TabixIndex.from_file(vcf_tbi))
+
+        # subclasses get their own instance of their own class
+        class SubIndex(puretabix.TabixIndex):
+            pass
+
+        sub_idx = SubIndex.load_once(vcf_filename + ".tbi")
+        assert type(sub_idx) is SubIndex
+        assert sub_idx.indexes.keys() == idx.indexes.keys()
+
+        # once cleared, the index is loaded again
+        puretabix.TabixIndex.clear_load_once()
+        assert idx is not puretabix.TabixIndex.load_once(vcf_filename + ".tbi")
+
+    def test_region_to_bins(self):
+        # one bin at each level for a region within the smallest bin, smallest first
+        assert puretabix.TabixIndex.region_to_bins(0, 0) == (4681, 585, 73, 9, 1, 0)
+        # spanning two of the smallest bins
+        assert puretabix.TabixIndex.region_to_bins(16383, 16384) == (
+            4681,
+            4682,
+            585,
+            73,
+            9,
+            1,
+            0,
+        )
+
+    def test_write_to_roundtrip(self, vcf_tbi):
+        idx = puretabix.TabixIndex.from_file(vcf_tbi)
+        vcf_tbi.seek(0)
+        raw = gzip.decompress(vcf_tbi.read())
+        written = io.BytesIO()
+        idx.write_to(written)
+        # the original may have a trailing count of unplaced reads
+        assert written.getvalue() == raw[: len(written.getvalue())]
+        reread = io.BytesIO(gzip.compress(written.getvalue()))
+        assert repr(puretabix.TabixIndex.from_file(reread)) == repr(idx)
+
+    def test_region_to_bin(self):
+        def region_to_bin_cascade(begin, end):
+            # straightforward version from the tabix specification
+            if begin >> 14 == end >> 14:
+                return ((1 << 15) - 1) // 7 + (begin >> 14)
+            if begin >> 17 == end >> 17:
+                return ((1 << 12) - 1) // 7 + (begin >> 17)
+            if begin >> 20 == end >> 20:
+                return ((1 << 9) - 1) // 7 + (begin >> 20)
+            if begin >> 23 == end >> 23:
+                return ((1 << 6) - 1) // 7 + (begin >> 23)
+            if begin >> 26 == end >> 26:
+                return ((1 << 3) - 1) // 7 + (begin >> 26)
+            return 0
+
+        rng = random.Random(42)
+        for _ in range(10000):
+            begin = rng.randrange(1 << rng.randrange(1, 31))
+            end = begin + rng.randrange(1 << rng.randrange(1, 31))
+            assert puretabix.TabixIndex.region_to_bin(
+                begin, end
+            ) == region_to_bin_cascade(begin, end), (begin, end)
+
+    def test_pickle(self, vcf_tbi):
+        # indexes may be sent to other processes
+        idx = puretabix.TabixIndex.from_file(vcf_tbi)
+        assert idx.lookup_virtual("1", 1108138, 1108138) != (None, None)
+        idx_pickled = pickle.loads(pickle.dumps(idx))
+        assert repr(idx_pickled) == repr(idx)
+        assert idx_pickled.lookup_virtual("1", 1108138, 1108138) == idx.lookup_virtual(
+            "1", 1108138, 1108138
+        )
+
+    def test_lookup_virtual_bin_order(self, vcf_tbi):
+        # bins are checked smallest first, but the result must not depend on the order
+        idx = puretabix.TabixIndex.from_file(vcf_tbi)
+        bin_index = idx.indexes["1"][0]
+        for start, end in ((1108138, 1108138), (861000, 1300000), (0, 10000000)):
+            linear_start = idx._lookup_linear("1", start)
+            chunks = [
+                chunk
+                for bin_i in reversed(idx.region_to_bins(start, end))
+                for chunk in bin_index.get(bin_i, ())
+                if chunk[1] > linear_start
+            ]
+            assert chunks
+            expected = (
+                min([linear_start] + [chunk[0] for chunk in chunks]),
+                max(chunk[1] for chunk in chunks),
+            )
+            assert idx.lookup_virtual("1", start, end) == expected
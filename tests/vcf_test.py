@@ -1,4 +1,16 @@
-from puretabix.vcf import VCFLine, read_vcf_lines
+import io
+import itertools
+
+import pytest
+
+from puretabix.vcf import (
+    LINE_START,
+    VCFAccumulator,
+    VCFLine,
+    get_vcf_fsm,
+    parse_vcf_data_line,
+    read_vcf_lines,
+)
 
 
 class TestVCFLineConstructors:
@@ -66,30 +78,102 @@ class TestVCFLineConstructors:
             == "VCFLine('','','',{},'chr1',123,('rs1',),'A',('C',),'.',('PASS',),{},({'GT': '1/1'}, {'GT': '1/1'}))"
         )
 
+    def test_data_genotype(self):
+        line = VCFLine.as_data(
+            "chr1",
+            123,
+            ["rs1"],
+            "A",
+            ["C", "G"],
+            ".",
+            ["PASS"],
+            {},
+            [{"GT": "0/1"}, {"GT": "2|."}, {"DP": "3"}, {"GT": "0/1"}],
+        )
+        assert line.get_genotype() == (("A", "C"), ("G", "."), (), ("A", "C"))
+
 
 class TestVCFFSM:
     def test_dbsnp(self, vcf_gz):
-        lines = tuple(map(bytes.decode, vcf_gz.readlines()))
-        lines_parsed = read_vcf_lines(lines)
+        # decode while streaming rather than holding every line in memory
+        lines, lines_to_parse = itertools.tee(
+            io.TextIOWrapper(vcf_gz, encoding="utf-8", newline="\n")
+        )
+        lines_parsed = read_vcf_lines(lines_to_parse)
 
         for line_in, line_out in zip(lines, lines_parsed):
             line_in = line_in.strip()
             assert line_in == str(line_out), (line_in, line_out)
 
     def test_dbsnp_gt(self, vcf_gz):
-        lines = tuple(map(bytes.decode, vcf_gz.readlines()))
+        lines = io.TextIOWrapper(vcf_gz, encoding="utf-8", newline="\n")
         lines_parsed = read_vcf_lines(lines)
 
-        for line_in, line_out in zip(lines, lines_parsed):
-            line_in = line_in.strip()
+        for line_out in lines_parsed:
             if not line_out.is_comment:
                 assert line_out.get_genotype()
 
     def test_dbsnp_header(self, vcf_gz):
-        lines = tuple(map(bytes.decode, vcf_gz.readlines()))
+        lines = io.TextIOWrapper(vcf_gz, encoding="utf-8", newline="\n")
         lines_parsed = read_vcf_lines(lines, header_only=True)
 
-        for line_in, line_out in zip(lines, lines_parsed):
-            line_in = line_in.strip()
+        for line_out in lines_parsed:
             assert line_out.is_comment
             assert str(line_out).startswith("#")
+
+    def test_header_only_stops_before_data(self):
+        # data lines after the header are never parsed, so can't raise
+        lines = ("##fileformat=VCFv4.2\n", "#CHROM\tPOS\n", "not a\tvcf line\n")
+        lines_parsed = tuple(read_vcf_lines(lines, header_only=True))
+        assert len(lines_parsed) == 2
+
+    def test_comment_struct_empty_key(self):
+        # an empty key is stored as is, but no key may follow it
+        lines_parsed = tuple(read_vcf_lines(["##contig=<=ID=1>\n"]))
+        assert lines_parsed[0].comment_value_dict == {"": "ID=1"}
+        with pytest.raises(ValueError):
+            tuple(read_vcf_lines(["##contig=<=ID=1,length=5>\n"]))
+
+    def test_get_vcf_fsm_independent(self):
+        # changing one machine must not change others, or the one read_vcf_lines uses
+        vcf_fsm = get_vcf_fsm()
+        assert vcf_fsm is not get_vcf_fsm()
+        vcf_fsm.transitions.clear()
+        # meta-information lines are always parsed by the state machine
+        lines_parsed = tuple(read_vcf_lines(["##fileformat=VCFv4.2\n"]))
+        assert str(lines_parsed[0]) == "##fileformat=VCFv4.2"
+
+    def test_parse_vcf_data_line(self, vcf_gz):
+        # splitting data lines must give the same as the state machine
+        vcf_fsm = get_vcf_fsm()
+        accumulator = VCFAccumulator()
+        lines = list(map(bytes.decode, vcf_gz.readlines()))
+        lines.append("1\t100\trs1;rs2\tA\tC,G\t30.5\tq10;PASS\tA=1;A=2,3;B;C=x=y\n")
+        lines.append("1\t100\t.\tA\tC\t.\tPASS\t.\tGT:DP\t0|1:3\t1/1\t")
+        n_parsed = 0
+        for line in lines:
+            vcfline = parse_vcf_data_line(line)
+            if vcfline is None:
+                assert line.startswith("#")
+                continue
+            n_parsed += 1
+            vcf_fsm.run(line, LINE_START, accumulator)
+            assert repr(vcfline) == repr(accumulator.to_vcfline())
+            accumulator.reset()
+        assert n_parsed
+
+    def test_parse_vcf_data_line_fallback(self):
+        # lines the state machine handles differently or rejects are left to it
+        for line in (
+            "##fileformat=VCFv4.2\n",
+            "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n",
+            "\t100\t.\tA\tC\t.\tPASS\t.\n",
+            "1\t100\t.\tA\tC\t.\tPASS\t.",
+            "1\t100\t.\tA\tC\t.\tPASS\t.\tGT\n",
+            "1\t1e2\t.\tA\tC\t.\tPASS\t.\n",
+            "1\t100\tr s\tA\tC\t.\tPASS\t.\n",
+            "1\t100\t.\ta\tC\t.\tPASS\t.\n",
+            "1\t100\t.\tA\tC\tq\tPASS\t.\n",
+            "1\t100\t.\tA\tC\t.\tPASS\tA=1\nB=2\n",
+        ):
+            assert parse_vcf_data_line(line) is None, line